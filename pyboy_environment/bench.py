@@ -0,0 +1,322 @@
+"""
+Throughput and latency benchmarks for the pyboy environments.
+
+Usage:
+    python -m pyboy_environment.bench --envs pokemon:brock mario:run --act_freqs 6 24 --num_envs 1 4 \\
+        --output bench.json --baseline bench_baseline.json --threshold 0.1
+
+Every configuration runs in a fresh process so construction time and peak RSS are not polluted by earlier runs.
+Results are written as JSON; when a baseline file is given, any metric that is worse than the baseline by more than
+the threshold is reported and the exit code is non-zero.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import platform
+import resource
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+# Metric name -> True when higher is better
+METRICS = {
+    "steps_per_sec": True,
+    "startup_time": False,
+    "mean_reset_latency": False,
+    "peak_rss_mb": False,
+    "mean_worker_startup_time": False,
+    "mean_worker_uss_mb": False,
+}
+
+
+def _peak_rss_mb() -> tuple[float, float]:
+    # ru_maxrss is reported in KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def _bench_single(config: dict) -> dict:
+    from pyboy_environment import suite
+
+    start = time.perf_counter()
+    env = suite.make(
+        config["domain"],
+        config["task"],
+        config["act_freq"],
+        headless=True,
+        backend=config["backend"],
+    )
+    # The emulator boots lazily, boot it here so startup matches the vectorised workers
+    env.pyboy
+    startup_time = time.perf_counter() - start
+
+    for _ in range(config["resets"]):
+        env.reset()
+    mean_reset_latency = env.mean_reset_latency()
+
+    env.reset()
+    env.enable_profiling(window=config["steps"])
+
+    start = time.perf_counter()
+    for _ in range(config["steps"]):
+        action = np.atleast_1d(env.sample_action())
+        _, _, done, truncated = env.step(action)
+        if done or truncated:
+            env.reset()
+    elapsed = time.perf_counter() - start
+
+    phases = {phase: stats["mean"] for phase, stats in env.phase_timings().items()}
+    env.pyboy.stop(save=False)
+
+    return {
+        "steps_per_sec": config["steps"] / elapsed,
+        "startup_time": startup_time,
+        "mean_reset_latency": mean_reset_latency,
+        "phases": phases,
+    }
+
+
+def _bench_vectorised(config: dict) -> dict:
+    from pyboy_environment.vec_environment import VecPyboyEnvironment
+
+    num_envs = config["num_envs"]
+
+    start = time.perf_counter()
+    venv = VecPyboyEnvironment(
+        config["domain"],
+        config["task"],
+        config["act_freq"],
+        num_envs,
+        start_method=config.get("start_method", "spawn"),
+        backend=config["backend"],
+    )
+    startup_time = time.perf_counter() - start
+
+    with venv:
+        worker_stats = venv.worker_stats()
+
+        start = time.perf_counter()
+        for _ in range(config["resets"]):
+            venv.reset()
+        mean_reset_latency = (time.perf_counter() - start) / max(config["resets"], 1)
+
+        venv.call("enable_profiling", window=config["steps"])
+
+        start = time.perf_counter()
+        for _ in range(config["steps"]):
+            venv.step(venv.sample_action())
+        elapsed = time.perf_counter() - start
+
+        worker_phases = venv.call("phase_timings")
+
+    phases = {
+        phase: float(np.mean([timings[phase]["mean"] for timings in worker_phases]))
+        for phase in worker_phases[0]
+    }
+
+    metrics = {
+        "steps_per_sec": config["steps"] * num_envs / elapsed,
+        "startup_time": startup_time,
+        "mean_reset_latency": mean_reset_latency,
+        "phases": phases,
+        "mean_worker_startup_time": float(
+            np.mean([stats["startup_time"] for stats in worker_stats])
+        ),
+        "workers": worker_stats,
+    }
+    # Unique memory is only available on Linux
+    if all("uss_mb" in stats for stats in worker_stats):
+        metrics["mean_worker_uss_mb"] = float(
+            np.mean([stats["uss_mb"] for stats in worker_stats])
+        )
+    return metrics
+
+
+def run_config(config: dict) -> dict:
+    if config["num_envs"] == 1:
+        metrics = _bench_single(config)
+    else:
+        metrics = _bench_vectorised(config)
+
+    own_rss, worker_rss = _peak_rss_mb()
+    metrics["peak_rss_mb"] = own_rss
+    metrics["worker_peak_rss_mb"] = worker_rss
+
+    return {**config, **metrics}
+
+
+def _isolated_worker(config: dict, remote) -> None:
+    try:
+        remote.send(("ok", run_config(config)))
+    except Exception:  # pylint: disable=broad-except
+        remote.send(("error", traceback.format_exc()))
+    finally:
+        remote.close()
+
+
+def run_isolated(config: dict, context) -> dict | None:
+    # A fresh (non-daemonic) process per configuration keeps startup time and peak RSS isolated
+    remote, work_remote = context.Pipe()
+    process = context.Process(target=_isolated_worker, args=(config, work_remote))
+    process.start()
+    work_remote.close()
+
+    try:
+        status, data = remote.recv()
+    except EOFError:
+        status, data = "error", "benchmark process exited unexpectedly"
+    process.join()
+    remote.close()
+
+    if status == "error":
+        logging.error(f"{config_key(config)} failed:\n{data}")
+        return None
+    return data
+
+
+def config_key(result: dict) -> str:
+    return (
+        f"{result['domain']}:{result['task']}:act_freq={result['act_freq']}"
+        f":num_envs={result['num_envs']}:backend={result.get('backend', 'pyboy')}"
+        f":start_method={result.get('start_method', 'spawn')}"
+    )
+
+
+def compare_to_baseline(
+    results: list[dict], baseline: list[dict], threshold: float
+) -> list[str]:
+    baseline = {config_key(result): result for result in baseline}
+
+    regressions = []
+    for result in results:
+        key = config_key(result)
+        if key not in baseline:
+            logging.info(f"No baseline for {key}")
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            old = baseline[key].get(metric)
+            new = result.get(metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            if higher_is_better:
+                change = -change
+
+            if change > threshold:
+                regressions.append(
+                    f"{key} {metric}: {old:.6g} -> {new:.6g} ({change * 100:.1f}% worse)"
+                )
+    return regressions
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument(
+        "--envs", type=str, nargs="+", default=["pokemon:brock", "mario:run"]
+    )
+    parse_args.add_argument("--act_freqs", type=int, nargs="+", default=[24])
+    parse_args.add_argument("--num_envs", type=int, nargs="+", default=[1])
+    parse_args.add_argument("--steps", type=int, default=1000)
+    parse_args.add_argument("--resets", type=int, default=20)
+    # "stub" benchmarks the decoding and reward layers without a ROM
+    parse_args.add_argument(
+        "--backend", type=str, default="pyboy", choices=["pyboy", "stub"]
+    )
+    # How vectorised workers are started, "forkserver" forks them from a preloaded server
+    parse_args.add_argument(
+        "--start_method",
+        type=str,
+        default="spawn",
+        choices=["spawn", "forkserver", "fork"],
+    )
+
+    parse_args.add_argument("-o", "--output", type=str, default="bench_results.json")
+    parse_args.add_argument("-b", "--baseline", type=str, default=None)
+    parse_args.add_argument("-t", "--threshold", type=float, default=0.1)
+    parse_args.add_argument("--save_baseline", action="store_true")
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    configs = []
+    for env in args.envs:
+        domain, task = env.split(":")
+        for act_freq in args.act_freqs:
+            for num_envs in args.num_envs:
+                configs.append(
+                    {
+                        "domain": domain,
+                        "task": task,
+                        "act_freq": act_freq,
+                        "num_envs": num_envs,
+                        "steps": args.steps,
+                        "resets": args.resets,
+                        "backend": args.backend,
+                        "start_method": args.start_method,
+                    }
+                )
+
+    context = mp.get_context("spawn")
+
+    results = []
+    for config in configs:
+        logging.info(f"Benchmarking {config_key(config)}")
+        result = run_isolated(config, context)
+        if result is None:
+            continue
+
+        logging.info(
+            f"{config_key(config)}: {result['steps_per_sec']:.1f} steps/s, "
+            f"startup {result['startup_time']:.3f}s, reset {result['mean_reset_latency'] * 1000:.2f}ms, "
+            f"peak RSS {result['peak_rss_mb']:.1f}MB"
+        )
+        results.append(result)
+
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": mp.cpu_count(),
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=4)
+    logging.info(f"Results written to {args.output}")
+
+    if args.baseline is not None:
+        if args.save_baseline or not Path(args.baseline).exists():
+            with open(args.baseline, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=4)
+            logging.info(f"Baseline written to {args.baseline}")
+            return
+
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        regressions = compare_to_baseline(results, baseline["results"], args.threshold)
+        if regressions:
+            for regression in regressions:
+                logging.error(f"Regression: {regression}")
+            raise SystemExit(1)
+        logging.info(
+            f"No regressions beyond {args.threshold * 100:.0f}% of the baseline"
+        )
+
+
+if __name__ == "__main__":
+    main()
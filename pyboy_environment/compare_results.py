@@ -2,49 +2,141 @@ import argparse
 import glob
 import json
 import logging
-from functools import cmp_to_key
+import os
 
 import numpy as np
 
 logging.basicConfig(level=logging.INFO)
 
 
-def compare_performance(results_one, results_two):
-    # Tier 1
-    if results_one["badges"] > results_two["badges"]:
-        return -1
-    elif results_one["badges"] < results_two["badges"]:
-        return 1
+# Metrics used for ranking, most significant first. Tier 1: badges, then actions when badges were won. Tier 2: caught
+# then seen Pokemon. Tier 3: mean party level then mean XP.
+RANK_METRICS = ("badges", "actions", "caught_pokemon", "seen_pokemon", "levels", "xp")
+
+INDEX_VERSION = 1
+
+
+def summarise(result):
+    # Everything the ranking needs from one results.json, computed once
+    return {
+        "badges": result["badges"],
+        "actions": result["actions"],
+        "caught_pokemon": result["caught_pokemon"],
+        "seen_pokemon": result["seen_pokemon"],
+        "levels": float(np.mean(result["levels"])),
+        "xp": float(np.mean(result["xp"])),
+    }
+
+
+def sort_key(summary):
+    # Ascending sort key ranking the best result first, higher is better for every metric in RANK_METRICS - actions
+    # only count when badges were won
+    actions = summary["actions"] if summary["badges"] > 0 else 0
+    return (
+        -summary["badges"],
+        -actions,
+        -summary["caught_pokemon"],
+        -summary["seen_pokemon"],
+        -summary["levels"],
+        -summary["xp"],
+    )
+
+
+def aggregate_runs(summaries, method):
+    if method == "best":
+        return min(summaries, key=sort_key)
+
+    reduce = np.mean if method == "mean" else np.median
+    return {
+        metric: float(reduce([summary[metric] for summary in summaries]))
+        for metric in RANK_METRICS
+    }
+
+
+def result_files(result_directory):
+    # results.json of a single run plus run_*/results.json from parallel evaluation
+    files = []
+    with os.scandir(result_directory) as entries:
+        for entry in entries:
+            if entry.name == "results.json" and entry.is_file():
+                files.append(entry.path)
+            elif entry.name.startswith("run_") and entry.is_dir():
+                path = f"{entry.path}/results.json"
+                if os.path.isfile(path):
+                    files.append(path)
+    return sorted(files)
+
+
+def directory_signature(result_directory, files):
+    signature = [os.stat(result_directory).st_mtime_ns]
+    for path in files:
+        stat = os.stat(path)
+        signature.append([path, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as file:
+        index = json.load(file)
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index["directories"]
+
+
+def save_index(index_path, directories):
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": INDEX_VERSION, "directories": directories}, file)
+    os.replace(temp_path, index_path)
+
+
+def ingest(results_path, index):
+    """
+    Updates the index with the result directories under results_path. Only directories that are new or whose
+    results files changed since the last run are read. Returns the number of directories read.
+    """
+    updated = 0
+    directories = {}
+    for result_directory in sorted(glob.glob(f"{results_path}/*")):
+        if not os.path.isdir(result_directory):
+            continue
+
+        upi = os.path.basename(result_directory)
+        files = result_files(result_directory)
+        if not files:
+            continue
+
+        signature = directory_signature(result_directory, files)
+        cached = index.get(upi)
+        if cached is not None and cached["signature"] == signature:
+            directories[upi] = cached
+            continue
 
-    if results_one["badges"] > 0 and results_two["badges"] > 0:
-        if results_one["actions"] > results_two["actions"]:
-            return -1
-        elif results_one["actions"] < results_two["actions"]:
-            return 1
-
-    # Tier 2
-    if results_one["caught_pokemon"] > results_two["caught_pokemon"]:
-        return -1
-    elif results_one["caught_pokemon"] < results_two["caught_pokemon"]:
-        return 1
+        logging.info(f"Reading results for UPI: {upi}")
+        runs = []
+        for path in files:
+            # With parallel runs results.json is a copy of run_0
+            if len(files) > 1 and path.endswith(f"{upi}/results.json"):
+                continue
+            with open(path, "r", encoding="utf-8") as file:
+                runs.append(summarise(json.load(file)))
 
-    if results_one["seen_pokemon"] > results_two["seen_pokemon"]:
-        return -1
-    elif results_one["seen_pokemon"] < results_two["seen_pokemon"]:
-        return 1
+        directories[upi] = {"signature": signature, "runs": runs}
+        updated += 1
 
-    # Tier 3
-    if np.mean(results_one["levels"]) > np.mean(results_two["levels"]):
-        return -1
-    elif np.mean(results_one["levels"]) < np.mean(results_two["levels"]):
-        return 1
+    index.clear()
+    index.update(directories)
+    return updated
 
-    if np.mean(results_one["xp"]) > np.mean(results_two["xp"]):
-        return -1
-    elif np.mean(results_one["xp"]) < np.mean(results_two["xp"]):
-        return 1
 
-    return 0
+def leaderboard(index, method="mean"):
+    entries = []
+    for upi, directory in index.items():
+        entry = aggregate_runs(directory["runs"], method)
+        entries.append(dict(entry, upi=upi, num_runs=len(directory["runs"])))
+    return sorted(entries, key=sort_key)
 
 
 def get_args():
@@ -52,6 +144,16 @@ def get_args():
 
     parse_args.add_argument("-r", "--results_path", type=str, required=True)
 
+    # How several runs of one submission are combined
+    parse_args.add_argument(
+        "-a",
+        "--aggregate",
+        type=str,
+        default="mean",
+        choices=["mean", "median", "best"],
+    )
+    parse_args.add_argument("-i", "--index_path", type=str, default=None)
+
     return parse_args.parse_args()
 
 
@@ -59,29 +161,20 @@ def main():
     args = get_args()
 
     results_path = args.results_path
-
-    result_directories = glob.glob(f"{results_path}/*")
-    logging.info(f"Found {len(result_directories)} results directories")
-    logging.info(f"Results directories: {result_directories}")
+    index_path = args.index_path or f"{results_path}/.leaderboard_index.json"
 
     logging.info(f"Comparing results in {results_path}")
 
-    results = []
-    for result_directory in result_directories:
-        upi = result_directory.split("/")[-1]
-        logging.info(f"Reading results for UPI: {upi}")
-
-        with open(f"{result_directory}/results.json", "r", encoding="utf-8") as file:
-            result = json.load(file)
-            result["upi"] = upi
-
-            results.append(result)
+    index = load_index(index_path)
+    updated = ingest(results_path, index)
+    save_index(index_path, index)
+    logging.info(f"Found {len(index)} results directories, {updated} new or changed")
 
-    results = sorted(results, key=cmp_to_key(compare_performance))
+    results = leaderboard(index, args.aggregate)
 
     for i, result in enumerate(results):
         logging.info(
-            f"Rank {i + 1}: {result['upi']} - Badges: {result['badges']} Caught: {result['caught_pokemon']} Seen: {result['seen_pokemon']} Levels: {np.mean(result['levels'])} XP: {np.mean(result['xp'])}"
+            f"Rank {i + 1}: {result['upi']} - Badges: {result['badges']} Caught: {result['caught_pokemon']} Seen: {result['seen_pokemon']} Levels: {result['levels']} XP: {result['xp']} Runs: {result['num_runs']}"
         )
 
 
@@ -0,0 +1,293 @@
+"""
+Streaming offline RL datasets stored as chunked, memory-mapped NumPy files.
+
+A dataset is a directory holding one `.npy` file per field per chunk (e.g. `states_00003.npy`) plus `index.json`,
+which lists the fields with their dtype and shape and the number of rows written to each chunk. Rows are written
+straight into the memory-mapped chunk; once a chunk is full it is handed to a background thread that flushes it to
+disk and updates the index, so stepping never waits on the disk.
+
+Usage:
+    env = suite.make("pokemon", "brock", 24, headless=True)
+    with DatasetWriter("data/brock", env.observation_space, env.action_num, stats_keys=["location.x"]) as writer:
+        recorder = DatasetRecorder(env, writer)
+        state = recorder.reset()
+        state, reward, done, truncated = recorder.step(action)
+
+    dataset = DatasetReader("data/brock")
+    for chunk in dataset:
+        chunk["states"], chunk["rewards"]
+"""
+
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+INDEX_FILE = "index.json"
+
+
+def _stat_value(stats: dict, key: str) -> float:
+    # Dotted keys reach into nested stats, numbers index lists, e.g. "location.x" or "hp.current.0"
+    value = stats
+    for part in key.split("."):
+        value = value[int(part)] if isinstance(value, list) else value[part]
+    return value
+
+
+class DatasetWriter:
+    def __init__(
+        self,
+        path: str,
+        observation_size: int,
+        action_num: int,
+        chunk_size: int = 65536,
+        stats_keys: list[str] = None,
+        state_dtype: np.dtype = np.float32,
+        store_next_states: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.stats_keys = list(stats_keys or [])
+
+        # Field name -> (dtype, shape of one row)
+        self.fields = {
+            "states": (np.dtype(state_dtype), (observation_size,)),
+            "actions": (np.dtype(np.float32), (action_num,)),
+            "rewards": (np.dtype(np.float32), ()),
+            "dones": (np.dtype(np.bool_), ()),
+            "truncateds": (np.dtype(np.bool_), ()),
+        }
+        if store_next_states:
+            self.fields["next_states"] = (np.dtype(state_dtype), (observation_size,))
+        if self.stats_keys:
+            self.fields["stats"] = (np.dtype(np.float64), (len(self.stats_keys),))
+
+        self.chunks: list[int] = []
+        self.chunk = None
+        self.row = 0
+        self.closed = False
+
+        self._index_lock = threading.Lock()
+        self._flush_queue = queue.Queue()
+        self._flush_error = None
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+
+        self._write_index()
+
+    def __len__(self) -> int:
+        return sum(self.chunks) + self.row
+
+    def add(
+        self,
+        state,
+        action,
+        reward: float,
+        done: bool,
+        truncated: bool,
+        stats: dict = None,
+        next_state=None,
+    ) -> None:
+        if self._flush_error is not None:
+            raise RuntimeError("Dataset flush failed") from self._flush_error
+
+        if self.chunk is None:
+            self._open_chunk()
+
+        # Everything is copied into the chunk before returning, callers may pass views that change on the next step
+        chunk = self.chunk
+        row = self.row
+        chunk["states"][row] = np.ravel(state)
+        chunk["actions"][row] = action
+        chunk["rewards"][row] = reward
+        chunk["dones"][row] = done
+        chunk["truncateds"][row] = truncated
+        if "next_states" in chunk:
+            chunk["next_states"][row] = np.ravel(next_state)
+        if self.stats_keys:
+            chunk["stats"][row] = [_stat_value(stats, key) for key in self.stats_keys]
+
+        self.row += 1
+        if self.row == self.chunk_size:
+            self._close_chunk()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.chunk is not None:
+            self._close_chunk()
+        self._flush_queue.put(None)
+        self._flush_thread.join()
+
+        if self._flush_error is not None:
+            raise RuntimeError("Dataset flush failed") from self._flush_error
+
+    def _open_chunk(self) -> None:
+        number = len(self.chunks)
+        self.chunk = {
+            name: open_memmap(
+                self.path / f"{name}_{number:05d}.npy",
+                mode="w+",
+                dtype=dtype,
+                shape=(self.chunk_size,) + shape,
+            )
+            for name, (dtype, shape) in self.fields.items()
+        }
+        self.row = 0
+
+    def _close_chunk(self) -> None:
+        number = len(self.chunks)
+        with self._index_lock:
+            self.chunks.append(0)
+        self._flush_queue.put((number, self.chunk, self.row))
+        self.chunk = None
+        self.row = 0
+
+    def _flush_loop(self) -> None:
+        while True:
+            item = self._flush_queue.get()
+            if item is None:
+                break
+
+            number, chunk, rows = item
+            try:
+                for array in chunk.values():
+                    array.flush()
+                # Only flushed rows are listed in the index
+                with self._index_lock:
+                    self.chunks[number] = rows
+                self._write_index()
+            except Exception as error:  # pylint: disable=broad-except
+                self._flush_error = error
+
+    def _write_index(self) -> None:
+        with self._index_lock:
+            index = {
+                "chunk_size": self.chunk_size,
+                "stats_keys": self.stats_keys,
+                "fields": {
+                    name: {"dtype": dtype.str, "shape": list(shape)}
+                    for name, (dtype, shape) in self.fields.items()
+                },
+                "chunks": list(self.chunks),
+            }
+
+            # Replace the index atomically so readers never see a partial file
+            temp_path = self.path / f"{INDEX_FILE}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(index, file, indent=4)
+            os.replace(temp_path, self.path / INDEX_FILE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class DatasetRecorder:
+    """
+    Wraps an environment and adds every step to a DatasetWriter. `states` holds the observation the action was taken
+    from, `next_states` the observation returned by the step.
+    """
+
+    def __init__(self, env, writer: DatasetWriter) -> None:
+        self.env = env
+        self.writer = writer
+        self.state = None
+
+    def reset(self) -> np.ndarray:
+        state = self.env.reset()
+        # Image observations are views onto a ring buffer that the next step overwrites
+        self.state = np.array(state, copy=True)
+        return state
+
+    def step(self, action) -> tuple:
+        next_state, reward, done, truncated = self.env.step(action)
+
+        stats = self.env._generate_game_stats() if self.writer.stats_keys else None
+        self.writer.add(
+            self.state, action, reward, done, truncated, stats, next_state=next_state
+        )
+
+        self.state = np.array(next_state, copy=True)
+        return next_state, reward, done, truncated
+
+    def step_many(self, actions) -> tuple:
+        # Every row needs the observation of its step, so unlike the environment's step_many each step is observed
+        state = self.state
+        total_reward = 0.0
+        dones = []
+        truncateds = []
+        for action in actions:
+            state, reward, done, truncated = self.step(action)
+            total_reward += reward
+            dones.append(done)
+            truncateds.append(truncated)
+            if done or truncated:
+                break
+
+        return (
+            state,
+            total_reward,
+            np.array(dones, dtype=np.bool_),
+            np.array(truncateds, dtype=np.bool_),
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+
+class DatasetReader:
+    """
+    Lazy view of a dataset written by DatasetWriter. Chunks are memory-mapped on access, so iterating or indexing
+    only reads the pages that are touched.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        with open(self.path / INDEX_FILE, "r", encoding="utf-8") as file:
+            index = json.load(file)
+
+        self.stats_keys = index["stats_keys"]
+        self.fields = list(index["fields"])
+        self.chunk_rows = index["chunks"]
+        # First row of every chunk, for random access
+        self.offsets = np.concatenate([[0], np.cumsum(self.chunk_rows)])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_rows)
+
+    def chunk(self, number: int) -> dict[str, np.ndarray]:
+        rows = self.chunk_rows[number]
+        return {
+            name: np.load(self.path / f"{name}_{number:05d}.npy", mmap_mode="r")[:rows]
+            for name in self.fields
+        }
+
+    def __iter__(self):
+        for number in range(self.num_chunks):
+            yield self.chunk(number)
+
+    def __getitem__(self, row: int) -> dict[str, np.ndarray]:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f"Row {row} outside of dataset of {len(self)} rows")
+
+        number = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        chunk = self.chunk(number)
+        return {
+            name: array[row - self.offsets[number]] for name, array in chunk.items()
+        }
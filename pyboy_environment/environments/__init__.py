@@ -1,3 +1,15 @@
 from .pyboy_environment import PyboyEnvironment
-from .mario import MarioEnvironment
-from .pokemon import PokemonEnvironment
+
+# The domain environments are imported on first access so using one domain does not load the other
+_DOMAIN_ENVIRONMENTS = {
+    "MarioEnvironment": "pyboy_environment.environments.mario",
+    "PokemonEnvironment": "pyboy_environment.environments.pokemon",
+}
+
+
+def __getattr__(name):
+    if name in _DOMAIN_ENVIRONMENTS:
+        import importlib
+
+        return getattr(importlib.import_module(_DOMAIN_ENVIRONMENTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
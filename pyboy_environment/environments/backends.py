@@ -0,0 +1,277 @@
+"""
+Emulator backends for PyboyEnvironment.
+
+The environments only use a small part of the PyBoy API: `memory`, `screen`, `frame_count`, `tick`, `send_input`,
+`load_state`/`save_state`, `game_area`, `game_wrapper`, `tilemap_background`, `set_emulation_speed` and `stop`.
+EmulatorBackend describes that surface; PyBoy itself is the default "pyboy" backend.
+
+StubBackend serves the same API without a ROM, from synthetic RAM or from a RAM trace recorded from a real game with
+`record_trace`. It lets the Python side of the environments (RAM decoding, rewards, observations) be profiled and
+load tested on machines that do not have the ROMs.
+"""
+
+import struct
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+
+# Memory regions stored in recorded traces: the background tilemaps, WRAM and HRAM
+TRACE_REGIONS = ((0x9800, 0xA000), (0xC000, 0xE000), (0xFF80, 0x10000))
+
+_STUB_STATE_MAGIC = b"PYBOYSTUB"
+
+SCREEN_ROWS = 144
+SCREEN_COLS = 160
+
+
+class EmulatorBackend(metaclass=ABCMeta):
+    memory = None
+    screen = None
+    frame_count = 0
+
+    @abstractmethod
+    def tick(self, count: int = 1, render: bool = True) -> bool:
+        pass
+
+    @abstractmethod
+    def send_input(self, event) -> None:
+        pass
+
+    @abstractmethod
+    def load_state(self, file_like_object) -> None:
+        pass
+
+    @abstractmethod
+    def save_state(self, file_like_object) -> None:
+        pass
+
+    @abstractmethod
+    def game_area(self) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def set_emulation_speed(self, target_speed: int) -> None:
+        pass
+
+    @abstractmethod
+    def stop(self, save: bool = True) -> None:
+        pass
+
+
+class StubMemory:
+    # Mirrors the PyBoy memory view: ints for single addresses and lists for slices
+    def __init__(self, size: int = 0x10000) -> None:
+        self.data = np.zeros(size, dtype=np.uint8)
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            return self.data[addr].tolist()
+        return int(self.data[addr])
+
+    def __setitem__(self, addr, value) -> None:
+        self.data[addr] = value
+
+
+class StubScreen:
+    def __init__(self) -> None:
+        self.raw_buffer_dims = (SCREEN_ROWS, SCREEN_COLS)
+        self.raw_buffer_format = "RGBA"
+        self.ndarray = np.full((SCREEN_ROWS, SCREEN_COLS, 4), 255, dtype=np.uint8)
+        self.raw_buffer = memoryview(self.ndarray).cast("B")
+        self.tilemap_position_list = [[0, 0, 0, 0] for _ in range(SCREEN_ROWS)]
+        self._image = None
+
+    @property
+    def image(self):
+        if self._image is None:
+            from PIL import Image
+
+            self._image = Image.frombuffer(
+                self.raw_buffer_format, self.raw_buffer_dims[::-1], self.ndarray
+            )
+        return self._image
+
+    def get_tilemap_position(self):
+        scx, scy, wx, wy = self.tilemap_position_list[0]
+        return (scx, scy), (wx, wy)
+
+
+class StubTileMap:
+    # Background tilemap read straight from the stub VRAM, tile identifiers as PyBoy returns them for unsigned data
+    def __init__(self, memory: StubMemory, offset: int = 0x9800) -> None:
+        self.memory = memory
+        self.offset = offset
+
+    def __getitem__(self, xy):
+        tiles = self.memory.data[self.offset : self.offset + 0x400].reshape(32, 32)
+        x, y = xy
+        # Indexed [x, y] like PyBoy, slices come back as a list of rows
+        tile = tiles[y, x]
+        return tile.tolist() if isinstance(tile, np.ndarray) else int(tile)
+
+
+class StubGameWrapper:
+    mapping_compressed = None
+
+    def __init__(self, backend: "StubBackend", shape: tuple[int, int]) -> None:
+        self.backend = backend
+        self.shape = shape
+        self.score = 0
+
+    def game_area_mapping(self, mapping, sprite_offset) -> None:
+        pass
+
+    def game_area(self) -> np.ndarray:
+        return self.backend.game_area()
+
+
+class StubBackend(EmulatorBackend):
+    """
+    Emulator stand-in that needs no ROM.
+
+    With a `trace` (path to a file written by `record_trace`) every tick advances through the recorded RAM, looping at
+    the end. Without one, `mutations` random bytes of WRAM are rewritten on every frame from a seeded generator, which
+    is enough to exercise the decoding and reward code paths.
+    """
+
+    def __init__(
+        self,
+        trace: str = None,
+        seed: int = 0,
+        mutations: int = 8,
+        game_area_shape: tuple[int, int] = (18, 20),
+    ) -> None:
+        self.game_area_shape = game_area_shape
+        self.memory = StubMemory()
+        self.screen = StubScreen()
+        self.tilemap_background = StubTileMap(self.memory)
+        self.game_wrapper = StubGameWrapper(self, game_area_shape)
+        self.frame_count = 0
+        self.inputs = []
+
+        self.seed = seed
+        self.mutations = mutations
+        self.rng = np.random.default_rng(seed)
+
+        self.trace = None
+        if trace is not None:
+            self.trace = load_trace(trace)
+            self._apply_trace_row(0)
+
+    def tick(self, count: int = 1, render: bool = True) -> bool:
+        self.frame_count += count
+
+        if self.trace is not None:
+            frames = self.trace["frames"]
+            span = frames[-1] + 1
+            row = np.searchsorted(frames, self.frame_count % span, side="right") - 1
+            self._apply_trace_row(max(row, 0))
+        elif self.mutations > 0:
+            addresses = self.rng.integers(0xC000, 0xE000, size=self.mutations)
+            self.memory.data[addresses] = self.rng.integers(
+                0, 256, size=self.mutations, dtype=np.uint8
+            )
+        return True
+
+    def send_input(self, event) -> None:
+        self.inputs.append(event)
+        if len(self.inputs) > 64:
+            del self.inputs[:32]
+
+    def load_state(self, file_like_object) -> None:
+        data = file_like_object.read()
+
+        if data.startswith(_STUB_STATE_MAGIC):
+            offset = len(_STUB_STATE_MAGIC)
+            (self.frame_count,) = struct.unpack_from("<Q", data, offset)
+            state = np.frombuffer(data, dtype=np.uint8, offset=offset + 8)
+            self.memory.data[:] = state
+        else:
+            # Real PyBoy savestates cannot be decoded without the emulator, start again from the first RAM image
+            self.memory.data[:] = 0
+            self.rng = np.random.default_rng(self.seed)
+            if self.trace is not None:
+                self._apply_trace_row(0)
+
+    def save_state(self, file_like_object) -> None:
+        file_like_object.write(_STUB_STATE_MAGIC)
+        file_like_object.write(struct.pack("<Q", self.frame_count))
+        file_like_object.write(self.memory.data.tobytes())
+
+    def game_area(self) -> np.ndarray:
+        # Unscrolled background tilemap, cropped to the game area
+        rows, cols = self.game_area_shape
+        tiles = self.memory.data[0x9800:0x9C00].reshape(32, 32)
+        return tiles[:rows, :cols].astype(np.uint32)
+
+    def set_emulation_speed(self, target_speed: int) -> None:
+        pass
+
+    def stop(self, save: bool = True) -> None:
+        pass
+
+    def _apply_trace_row(self, row: int) -> None:
+        data = self.trace["data"][row]
+        offset = 0
+        for start, end in self.trace["regions"]:
+            self.memory.data[start:end] = data[offset : offset + end - start]
+            offset += end - start
+
+
+def make_backend(backend, rom_path: str, headless: bool, **kwargs) -> EmulatorBackend:
+    """
+    Creates the emulator for an environment. `backend` is either a name ("pyboy" or "stub") or an already constructed
+    backend instance, which is returned as is.
+    """
+    if not isinstance(backend, str):
+        return backend
+
+    if backend == "pyboy":
+        from pyboy import PyBoy
+
+        EmulatorBackend.register(PyBoy)
+
+        head = "null" if headless else "SDL2"
+        return PyBoy(
+            rom_path,
+            window=head,
+            sound=False,
+            sound_emulated=False,
+        )
+    if backend == "stub":
+        return StubBackend(**kwargs)
+    raise ValueError(f"Unknown emulator backend: {backend}")
+
+
+def record_trace(env, path: str, steps: int, regions=TRACE_REGIONS) -> None:
+    """
+    Steps a real environment with its random policy and records the RAM regions after every step, for replay through
+    StubBackend(trace=path).
+    """
+    size = sum(end - start for start, end in regions)
+    frames = np.zeros(steps, dtype=np.int64)
+    data = np.zeros((steps, size), dtype=np.uint8)
+
+    env.reset()
+    start_frame = env.pyboy.frame_count
+    for step in range(steps):
+        env.step(np.atleast_1d(env.sample_action()))
+
+        frames[step] = env.pyboy.frame_count - start_frame
+        offset = 0
+        for start, end in regions:
+            data[step, offset : offset + end - start] = env.pyboy.memory[start:end]
+            offset += end - start
+
+    np.savez_compressed(
+        path, frames=frames, regions=np.asarray(regions, dtype=np.int64), data=data
+    )
+
+
+def load_trace(path: str) -> dict:
+    with np.load(path) as trace:
+        return {
+            "frames": trace["frames"],
+            "regions": [tuple(region) for region in trace["regions"].tolist()],
+            "data": trace["data"],
+        }
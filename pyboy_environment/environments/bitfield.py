@@ -0,0 +1,84 @@
+"""
+Vectorised decoding of bitfields stored in RAM - event flags, Pokedex caught/seen flags, badges.
+
+Game Boy games store flag n in bit n % 8 of byte n // 8, so flags are expanded with the little-endian bit order.
+All functions take NumPy uint8 arrays, typically slices of the RAM snapshot.
+"""
+
+import numpy as np
+
+# Number of set bits for every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(data: np.ndarray) -> int:
+    return int(POPCOUNT[data].sum(dtype=np.int64))
+
+
+def popcount_per_byte(data: np.ndarray) -> np.ndarray:
+    return POPCOUNT[data]
+
+
+def unpack_flags(data: np.ndarray, axis: int = -1) -> np.ndarray:
+    # Flag n of the returned vector is bit n % 8 of byte n // 8
+    return np.unpackbits(data, axis=axis, bitorder="little")
+
+
+def pack_flags(flags: np.ndarray) -> np.ndarray:
+    return np.packbits(flags, bitorder="little")
+
+
+def read_flag(memory: np.ndarray, address: int, bit: int) -> bool:
+    return bool((memory[address] >> bit) & 1)
+
+
+def flag_address(base: int, flag: int) -> tuple[int, int]:
+    # (address, bit) of flag number `flag` in a bitfield starting at `base`
+    return base + (flag >> 3), flag & 7
+
+
+class FlagTracker:
+    """
+    Tracks which flags of a bitfield changed between updates.
+
+    The previous bytes are kept and compared as a whole, only the bytes that differ are expanded to flags, so an update
+    where nothing changed is a single vectorised comparison. Flags set since the last `prime` are collected in
+    `episode_flags`.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.previous = np.zeros(size, dtype=np.uint8)
+        # Flag numbers set and cleared by the last update
+        self.set_flags = np.zeros(0, dtype=np.int64)
+        self.cleared_flags = np.zeros(0, dtype=np.int64)
+        self.episode_flags: set[int] = set()
+
+    def prime(self, data: np.ndarray) -> None:
+        self.previous[:] = data
+        self.set_flags = self.set_flags[:0]
+        self.cleared_flags = self.cleared_flags[:0]
+        self.episode_flags.clear()
+
+    def update(self, data: np.ndarray) -> None:
+        changed = np.flatnonzero(data != self.previous)
+        if len(changed) == 0:
+            self.set_flags = self.set_flags[:0]
+            self.cleared_flags = self.cleared_flags[:0]
+            return
+
+        new = data[changed]
+        old = self.previous[changed]
+        self.previous[changed] = new
+
+        self.set_flags = self._flag_numbers(changed, new & ~old)
+        self.cleared_flags = self._flag_numbers(changed, old & ~new)
+        self.episode_flags.update(self.set_flags.tolist())
+
+    @property
+    def net_change(self) -> int:
+        return len(self.set_flags) - len(self.cleared_flags)
+
+    @staticmethod
+    def _flag_numbers(byte_indices: np.ndarray, bits: np.ndarray) -> np.ndarray:
+        rows, columns = np.nonzero(unpack_flags(bits[:, None], axis=1))
+        return byte_indices[rows] * 8 + columns
@@ -0,0 +1,91 @@
+"""
+Pixel observations read straight from the emulator's screen buffer.
+
+The screen is wrapped as a NumPy view once, downsampling is a strided view of it, and the grayscale conversion is done
+with integer weights into preallocated buffers. Stacked frames live in a ring buffer holding every frame twice, so the
+last `stack` frames in chronological order are always one contiguous slice - nothing is allocated per step.
+"""
+
+import numpy as np
+
+# ITU-R BT.601 luma weights scaled to sum to 256
+_GRAY_WEIGHTS = (77, 150, 29)
+
+
+class ImageObservation:
+    def __init__(
+        self,
+        screen: np.ndarray,
+        scale: int = 2,
+        grayscale: bool = True,
+        stack: int = 1,
+    ) -> None:
+        """
+        `screen` is the emulator's (rows, cols, 4) RGBA screen array, which is updated in place on every rendered frame.
+        Every `scale`-th pixel is kept in both directions.
+        """
+        if scale < 1 or stack < 1:
+            raise ValueError(f"scale and stack must be at least 1: {scale}, {stack}")
+
+        self.scale = scale
+        self.grayscale = grayscale
+        self.stack = stack
+
+        # Zero-copy downsampled RGB view of the screen
+        self.source = screen[::scale, ::scale, :3]
+        rows, cols = self.source.shape[:2]
+
+        frame_shape = (rows, cols) if grayscale else (rows, cols, 3)
+        self.frame_shape = frame_shape
+
+        # Every frame is written at index and index + stack, frames[index + 1 : index + 1 + stack] is the stack
+        self.frames = np.zeros((2 * stack,) + frame_shape, dtype=np.uint8)
+        self.index = stack - 1
+
+        self._luma = np.zeros((rows, cols), dtype=np.uint16)
+        self._channel = np.zeros((rows, cols), dtype=np.uint16)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return (self.stack,) + self.frame_shape
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def reset(self) -> np.ndarray:
+        # Fills the whole stack with the current screen
+        frame = self._read_frame()
+        self.frames[:] = frame
+        self.index = self.stack - 1
+        return self.observation()
+
+    def update(self) -> np.ndarray:
+        self.index = (self.index + 1) % self.stack
+        frame = self._read_frame()
+        self.frames[self.index] = frame
+        self.frames[self.index + self.stack] = frame
+        return self.observation()
+
+    def observation(self) -> np.ndarray:
+        # View onto the ring buffer, overwritten by the next update - copy it if it needs to be kept
+        start = self.index + 1
+        return self.frames[start : start + self.stack]
+
+    def _read_frame(self) -> np.ndarray:
+        if not self.grayscale:
+            return self.source
+
+        luma = self._luma
+        channel = self._channel
+        np.multiply(self.source[..., 0], _GRAY_WEIGHTS[0], out=luma, dtype=np.uint16)
+        for index in (1, 2):
+            np.multiply(
+                self.source[..., index],
+                _GRAY_WEIGHTS[index],
+                out=channel,
+                dtype=np.uint16,
+            )
+            np.add(luma, channel, out=luma)
+        np.right_shift(luma, 8, out=luma)
+        return luma
@@ -13,10 +13,36 @@ from abc import ABCMeta
 import numpy as np
 from pyboy.utils import WindowEvent
 
-from pyboy_environment.environments.pyboy_environment import PyboyEnvironment
+from pyboy_environment.environments.pyboy_environment import (
+    PyboyEnvironment,
+    frame_cached,
+)
+from pyboy_environment.environments.ram_schema import RamField, RamSchema
 
 
 class MarioEnvironment(PyboyEnvironment, metaclass=ABCMeta):
+    # The stage, world and timer digits are read from the background tilemap in VRAM
+    snapshot_regions = PyboyEnvironment.snapshot_regions + ((0x9820, 0x9840),)
+
+    # PyBoy's Super Mario Land game wrapper covers 20x16 tiles
+    game_area_shape = (16, 20)
+
+    ram_schema = RamSchema(
+        [
+            RamField("level_block", 0xC0AB),
+            RamField("mario_x", 0xC202),
+            RamField("mario_pose", 0xC203),
+            RamField("time_digits", 0x9831, width=3),
+            RamField("lives", 0xDA15),
+            RamField("coins", 0xFFFA),
+            RamField("stage", 0x982E),
+            RamField("world", 0x982C),
+            RamField("game_over", 0xFFB3),
+            RamField("dead_timer", 0xFFA6),
+            RamField("dead_jump_timer", 0xC0AC),
+        ]
+    )
+
     def __init__(
         self,
         act_freq: int,
@@ -24,10 +50,12 @@ class MarioEnvironment(PyboyEnvironment, metaclass=ABCMeta):
         release_button: list[WindowEvent],
         emulation_speed: int = 0,
         headless: bool = False,
+        backend: str = "pyboy",
+        task: str = "mario",
     ) -> None:
 
         super().__init__(
-            task="mario",
+            task=task,
             rom_name="SuperMarioLand.gb",
             init_state_file_name="init.state",
             domain="mario",
@@ -36,6 +64,7 @@ class MarioEnvironment(PyboyEnvironment, metaclass=ABCMeta):
             release_button=release_button,
             emulation_speed=emulation_speed,
             headless=headless,
+            backend=backend,
         )
 
     def _get_state(self) -> np.ndarray:
@@ -43,6 +72,7 @@ class MarioEnvironment(PyboyEnvironment, metaclass=ABCMeta):
         # TODO image based being frame or game area frame...
         return self.game_area().flatten().tolist()
 
+    @frame_cached
     def _generate_game_stats(self) -> dict[str, int]:
         return {
             "lives": self._get_lives(),
@@ -60,46 +90,45 @@ class MarioEnvironment(PyboyEnvironment, metaclass=ABCMeta):
     def _get_x_position(self):
         # Copied from: https://github.com/lixado/PyBoy-RL/blob/main/AISettings/MarioAISettings.py
         # Do not understand how this works...
-        level_block = self._read_m(0xC0AB)
-        mario_x = self._read_m(0xC202)
+        ram = self._decode_ram()
+        level_block = ram["level_block"]
+        mario_x = ram["mario_x"]
         scx = self.pyboy.screen.tilemap_position_list[16][0]
         real = (scx - 7) % 16 if (scx - 7) % 16 != 0 else 16
         real_x_position = level_block * 16 + real + mario_x
         return real_x_position
 
     def _get_time(self):
-        hundreds = self._read_m(0x9831)
-        tens = self._read_m(0x9832)
-        ones = self._read_m(0x9833)
+        hundreds, tens, ones = self._decode_ram()["time_digits"].tolist()
         return int(str(hundreds) + str(tens) + str(ones))
 
     def _get_lives(self):
-        return self._read_m(0xDA15)
+        return self._decode_ram()["lives"]
 
     def _get_score(self):
         mario = self.pyboy.game_wrapper
         return mario.score
 
     def _get_coins(self):
-        return self._read_m(0xFFFA)
+        return self._decode_ram()["coins"]
 
     def _get_stage(self):
-        return self._read_m(0x982E)
+        return self._decode_ram()["stage"]
 
     def _get_world(self):
-        return self._read_m(0x982C)
+        return self._decode_ram()["world"]
 
     def _get_game_over(self):
-        return self._read_m(0xFFB3) == 0x39
+        return self._decode_ram()["game_over"] == 0x39
 
     def _get_mario_pose(self):
-        return self._read_m(0xC203)
+        return self._decode_ram()["mario_pose"]
 
     def _get_dead_timer(self):
-        return self._read_m(0xFFA6)
+        return self._decode_ram()["dead_timer"]
 
     def _get_dead_jump_timer(self):
-        return self._read_m(0xC0AC)
+        return self._decode_ram()["dead_jump_timer"]
 
     def game_area(self) -> np.ndarray:
         mario = self.pyboy.game_wrapper
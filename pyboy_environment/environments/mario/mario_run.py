@@ -14,6 +14,7 @@ class MarioRun(MarioEnvironment):
         act_freq: int,
         emulation_speed: int = 0,
         headless: bool = False,
+        backend: str = "pyboy",
     ) -> None:
 
         valid_actions: List[WindowEvent] = [
@@ -40,6 +41,8 @@ class MarioRun(MarioEnvironment):
             release_button=release_button,
             emulation_speed=emulation_speed,
             headless=headless,
+            backend=backend,
+            task="run",
         )
 
         self.max_level_progress = 0
@@ -58,7 +61,8 @@ class MarioRun(MarioEnvironment):
 
     @cached_property
     def observation_space(self) -> int:
-        return len(self._get_state())
+        # _get_state is the flattened game area
+        return int(np.prod(self.game_area_shape))
 
     @cached_property
     def action_num(self) -> int:
@@ -78,8 +82,7 @@ class MarioRun(MarioEnvironment):
             else:
                 self.pyboy.send_input(self.release_button[i])
 
-        for i in range(self.act_freq):
-            self.pyboy.tick()
+        self._tick_emulator(self.act_freq)
 
     def _calculate_reward(self, new_state: Dict[str, int]) -> float:
         reward_stats = {
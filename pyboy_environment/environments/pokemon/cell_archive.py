@@ -0,0 +1,168 @@
+"""
+Go-Explore style archive of savestates keyed by a coarse description of the game state.
+
+Every step the decoded game stats are discretised into a cell - by default the map, the position on a coarse grid, the
+badges, the summed party level and the number of events. The first time a cell is reached, or when it is reached
+again with a higher score (or the same score in fewer steps), the emulator state is saved into the cell. Resets can
+then restore a sampled cell instead of the task's init state, so episodes start from the frontier instead of
+re-walking the start of the game.
+
+Cells are sampled with weight 1 / sqrt(selections + 1) + 1 / sqrt(visits + 1), favouring cells that were rarely
+returned to or reached. Memory is bounded by `max_cells` and `max_bytes`: once over either, the cells with the
+lowest weight are evicted. With a `store` (a pyboy_environment.savestate_store.SavestateStore) cells only hold the
+key of their state, pinned in the store until the cell is evicted, and `max_bytes` counts the encoded states.
+"""
+
+import numpy as np
+
+
+class Cell:
+    def __init__(self, state, size: int, action, score: float, steps: int) -> None:
+        # Savestate (or its store key) taken right after `action`, whose queued inputs are restored with it
+        self.state = state
+        # Bytes held for the state
+        self.size = size
+        self.action = action
+        self.score = score
+        self.steps = steps
+
+        self.visits = 1
+        self.selections = 0
+
+    def weight(self) -> float:
+        return 1.0 / np.sqrt(self.selections + 1) + 1.0 / np.sqrt(self.visits + 1)
+
+
+class CellArchive:
+    def __init__(
+        self,
+        position_cell_size: int = 4,
+        level_bucket: int = 5,
+        event_bucket: int = 4,
+        key_function=None,
+        max_cells: int = 4096,
+        max_bytes: int = 512 * 1024 * 1024,
+        seed: int = None,
+        store=None,
+    ) -> None:
+        self.position_cell_size = position_cell_size
+        self.level_bucket = level_bucket
+        self.event_bucket = event_bucket
+        # Replaces cell_key, maps the game stats to a hashable cell
+        self.key_function = key_function
+
+        self.max_cells = max_cells
+        self.max_bytes = max_bytes
+        self.store = store
+
+        self.cells: dict = {}
+        self.num_bytes = 0
+        self.evictions = 0
+
+        self.rng = np.random.default_rng(seed)
+
+    def cell_key(self, game_stats: dict) -> tuple:
+        if self.key_function is not None:
+            return self.key_function(game_stats)
+
+        location = game_stats["location"]
+        return (
+            location["map_id"],
+            location["x"] // self.position_cell_size,
+            location["y"] // self.position_cell_size,
+            game_stats["badges"],
+            sum(game_stats["levels"]) // self.level_bucket,
+            sum(game_stats["events"]) // self.event_bucket,
+        )
+
+    def update(self, key, score: float, steps: int, save_state, action) -> bool:
+        """
+        Records a visit to cell `key`. `save_state` is only called when the cell is new or improved on, returns True
+        in that case.
+        """
+        cell = self.cells.get(key)
+        if cell is not None:
+            cell.visits += 1
+            if score < cell.score or (score == cell.score and steps >= cell.steps):
+                return False
+
+            state, size = self._store(save_state())
+            self._release(cell)
+            self.num_bytes += size - cell.size
+            cell.state = state
+            cell.size = size
+            cell.action = action
+            cell.score = score
+            cell.steps = steps
+        else:
+            state, size = self._store(save_state())
+            self.cells[key] = Cell(state, size, action, score, steps)
+            self.num_bytes += size
+
+        if len(self.cells) > self.max_cells or self.num_bytes > self.max_bytes:
+            self.evict()
+        return True
+
+    def state(self, cell: Cell) -> bytes:
+        # Raw savestate of a cell
+        if self.store is not None:
+            return self.store.get(cell.state)
+        return cell.state
+
+    def discard(self, key) -> None:
+        cell = self.cells.pop(key, None)
+        if cell is not None:
+            self._release(cell)
+            self.num_bytes -= cell.size
+
+    def _store(self, state: bytes) -> tuple:
+        # What the cell holds for the state, and its size
+        if self.store is None:
+            return state, len(state)
+        key = self.store.put(state, pin=True)
+        return key, self.store.encoded_size(key)
+
+    def _release(self, cell: Cell) -> None:
+        if self.store is not None:
+            self.store.unpin(cell.state)
+
+    def sample(self):
+        # Returns (key, cell) or None when the archive is empty
+        if not self.cells:
+            return None
+
+        keys = list(self.cells)
+        weights = np.array([self.cells[key].weight() for key in keys])
+        key = keys[self.rng.choice(len(keys), p=weights / weights.sum())]
+
+        cell = self.cells[key]
+        cell.selections += 1
+        return key, cell
+
+    def evict(self, fraction: float = 0.1) -> None:
+        # Drops a tenth of the archive at once, so eviction does not run on every new cell once full
+        keys = list(self.cells)
+        weights = np.array([self.cells[key].weight() for key in keys])
+        order = np.argsort(weights, kind="stable")
+
+        count = max(1, int(len(keys) * fraction))
+        count = max(count, len(keys) - self.max_cells)
+        for index in order[:count]:
+            self.discard(keys[index])
+        self.evictions += count
+
+        # Cells may be large savestates, keep evicting until under the byte budget
+        if self.num_bytes > self.max_bytes and self.cells:
+            self.evict(fraction)
+
+    def clear(self) -> None:
+        for cell in self.cells.values():
+            self._release(cell)
+        self.cells.clear()
+        self.num_bytes = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.cells
+
+    def __len__(self) -> int:
+        return len(self.cells)
@@ -1,3 +1,4 @@
+import io
 import random
 from functools import cached_property
 from abc import abstractmethod
@@ -5,11 +6,65 @@ from abc import abstractmethod
 import numpy as np
 from pyboy.utils import WindowEvent
 
-from pyboy_environment.environments.pyboy_environment import PyboyEnvironment
+from pyboy_environment.environments.pyboy_environment import (
+    PyboyEnvironment,
+    frame_cached,
+)
+from pyboy_environment.environments.bitfield import FlagTracker
 from pyboy_environment.environments.pokemon import pokemon_constants as pkc
+from pyboy_environment.environments.pokemon.cell_archive import CellArchive
+from pyboy_environment.environments.ram_schema import RamField, RamSchema
+
+# Each party Pokemon's data block is 0x2C bytes long
+PARTY_STRIDE = 0x2C
+
+POKEDEX_FLAG_BYTES = 19
+EVENT_FLAG_BYTES = 0xD886 - 0xD747
+
+_SCREEN_TILE_ROWS = np.arange(18)
+_SCREEN_TILE_COLS = np.arange(20)
+
+# Start addresses and sizes of the bitfields followed by the flag trackers
+TRACKED_FLAGS = {
+    "caught": (0xD2F7, POKEDEX_FLAG_BYTES),
+    "seen": (0xD30A, POKEDEX_FLAG_BYTES),
+    "events": (0xD747, EVENT_FLAG_BYTES),
+}
 
 
 class PokemonEnvironment(PyboyEnvironment):
+    ram_schema = RamSchema(
+        [
+            RamField("x", 0xD362),
+            RamField("y", 0xD361),
+            RamField("map_id", 0xD35E),
+            RamField("party_size", 0xD163),
+            # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/pokemon_constants.asm
+            RamField("party_id", 0xD164, count=6),
+            # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/type_constants.asm
+            RamField("party_type", 0xD170, count=6, stride=PARTY_STRIDE, width=2),
+            RamField("party_level", 0xD18C, count=6, stride=PARTY_STRIDE),
+            # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/status_constants.asm
+            RamField("party_status", 0xD16F, count=6, stride=PARTY_STRIDE),
+            RamField("party_hp", 0xD16C, "u16", count=6, stride=PARTY_STRIDE),
+            RamField("party_max_hp", 0xD18D, "u16", count=6, stride=PARTY_STRIDE),
+            RamField("party_xp", 0xD179, "u24", count=6, stride=PARTY_STRIDE),
+            RamField("badges", 0xD356, "popcount"),
+            RamField("caught_pokemon", 0xD2F7, "popcount", width=POKEDEX_FLAG_BYTES),
+            RamField("seen_pokemon", 0xD30A, "popcount", width=POKEDEX_FLAG_BYTES),
+            RamField("money", 0xD347, "bcd", width=3),
+            # Event flags 0xD747 - 0xD885, bits set per byte
+            RamField("events", 0xD747, "popcount", count=EVENT_FLAG_BYTES),
+            # The same bitfields as one flag per entry, flag n is Pokedex number n + 1 / event n
+            RamField("caught_flags", 0xD2F7, "bits", width=POKEDEX_FLAG_BYTES),
+            RamField("seen_flags", 0xD30A, "bits", width=POKEDEX_FLAG_BYTES),
+            RamField("event_flags", 0xD747, "bits", width=EVENT_FLAG_BYTES),
+        ]
+    )
+
+    # PyBoy's Pokemon Gen 1 game wrapper covers the visible 20x18 tiles
+    game_area_shape = (18, 20)
+
     def __init__(
         self,
         act_freq: int,
@@ -19,7 +74,25 @@ class PokemonEnvironment(PyboyEnvironment):
         emulation_speed: int = 0,
         headless: bool = False,
         init_name: str = "has_pokedex.state",
+        backend: str = "pyboy",
     ) -> None:
+        # Incremental change tracking of the caught/seen/event flags, primed whenever a state is loaded
+        self.flag_trackers = {
+            name: FlagTracker(size) for name, (_, size) in TRACKED_FLAGS.items()
+        }
+        self._flag_key = None
+
+        # Walkable tile lookups per (tileset, collision pointer, grass tile) and the collision map output
+        self._walkable_tiles_cache: dict[tuple[int, int, int], np.ndarray] = {}
+        self._collision_area = np.zeros((18, 20), dtype=np.uint32)
+        self._tilemap_bytes = bytearray(0x400)
+        self._tilemap = np.frombuffer(self._tilemap_bytes, dtype=np.uint8).reshape(
+            32, 32
+        )
+        # Counted apart from the game stats cache, the collision map is not part of the stats
+        self.collision_cache_hits = 0
+        self.collision_cache_misses = 0
+
         super().__init__(
             task=task,
             rom_name="PokemonRed.gb",
@@ -30,10 +103,19 @@ class PokemonEnvironment(PyboyEnvironment):
             valid_actions=valid_actions,
             release_button=release_button,
             headless=headless,
+            backend=backend,
         )
     
         self.current_button = None
 
+        # Go-Explore style resets from archived cells, see enable_cell_archive
+        self.cell_archive = None
+        self.cell_restore_probability = 1.0
+        # Cell the episode was restored from, and the score and steps of the trajectory reaching the current state
+        self.start_cell = None
+        self.cell_score = 0.0
+        self.cell_steps = 0
+
     @cached_property
     def min_action_value(self) -> float:
         return 0
@@ -55,33 +137,100 @@ class PokemonEnvironment(PyboyEnvironment):
     def sample_action(self) -> int:
         return random.uniform(0, 1)
 
+    def enable_cell_archive(
+        self, archive: CellArchive = None, restore_probability: float = 1.0
+    ) -> CellArchive:
+        """
+        Adds the state after every step to a Go-Explore cell archive, and makes reset restore a cell sampled from it
+        with probability `restore_probability` instead of the init state. Environments in one process can share an
+        archive. Recorded trajectories assume resets to the init state, so do not combine the two.
+        """
+        self.cell_archive = archive if archive is not None else CellArchive()
+        self.cell_restore_probability = restore_probability
+        return self.cell_archive
+
+    def disable_cell_archive(self) -> None:
+        self.cell_archive = None
+        self.start_cell = None
+
+    def _on_step(self, action, reward: float) -> None:
+        if self.cell_archive is not None:
+            self._update_cell_archive(action, reward)
+
+    def _update_cell_archive(self, action, reward: float) -> None:
+        self.cell_score += reward
+        self.cell_steps += 1
+
+        archive = self.cell_archive
+        archive.update(
+            archive.cell_key(self._generate_game_stats()),
+            self.cell_score,
+            self.cell_steps,
+            self._save_state,
+            np.array(action, dtype=np.float64),
+        )
+
+    def _reset_emulator(self) -> None:
+        self.start_cell = None
+        self.cell_score = 0.0
+        self.cell_steps = 0
+
+        archive = self.cell_archive
+        if archive is not None and archive.rng.random() < self.cell_restore_probability:
+            sampled = archive.sample()
+            if sampled is not None:
+                key, cell = sampled
+                try:
+                    state = archive.state(cell)
+                except KeyError:
+                    # The state is gone from the archive's store, start from the init state instead
+                    archive.discard(key)
+                else:
+                    self._load_state(io.BytesIO(state))
+                    self._restore_pending_inputs(cell.action)
+                    self.start_cell = key
+                    self.cell_score = cell.score
+                    self.cell_steps = cell.steps
+                    return
+
+        super()._reset_emulator()
+
     def _get_state(self) -> np.ndarray:
         # Implement your state retrieval logic here - compact state based representation
         raise NotImplementedError(
             "Non-image based observation space not implemented - override this method to implement it"
         )
 
-    def _run_action_on_emulator(self, action_array: np.ndarray) -> None:
+    def _action_to_button(self, action_array: np.ndarray) -> int:
         action = action_array[0]
         action = min(action, 0.99)
 
         # Continuous Action is a float between 0 - 1 from Value based methods
         # We need to convert this to an action that the emulator can understand
         bins = np.linspace(0, 1, len(self.valid_actions) + 1)
-        button = np.digitize(action, bins) - 1
+        return np.digitize(action, bins) - 1
+
+    def _run_action_on_emulator(self, action_array: np.ndarray) -> None:
+        button = self._action_to_button(action_array)
 
         self.current_button = button
 
         # Push the button for a few frames
         self.pyboy.send_input(self.valid_actions[button])
 
-        for _ in range(self.act_freq):
-            self.pyboy.tick()
+        self._tick_emulator(self.act_freq)
 
         # Release the button
         self.pyboy.send_input(self.release_button[button])
 
+    def _restore_pending_inputs(self, action_array: np.ndarray) -> None:
+        # The release queued after the last tick of an action is applied on the next tick
+        self.pyboy.send_input(self.release_button[self._action_to_button(action_array)])
+
+    @frame_cached
     def _generate_game_stats(self) -> dict[str, any]:
+        # Step generates the stats once per step, so the flag changes always cover the prior stats -> these stats
+        self._update_flag_trackers()
         return {
             "location": self._get_location(),
             "party_size": self._get_party_size(),
@@ -113,10 +262,34 @@ class PokemonEnvironment(PyboyEnvironment):
         # Implement your truncation check logic here
         return False
 
+    def _load_state(self, file_like_object) -> None:
+        super()._load_state(file_like_object)
+
+        memory = self._memory_snapshot()
+        for name, (address, size) in TRACKED_FLAGS.items():
+            self.flag_trackers[name].prime(memory[address : address + size])
+        self._flag_key = self._frame_key()
+
+    def _update_flag_trackers(self) -> dict[str, FlagTracker]:
+        # Diffs the flags against the last update, at most once per emulated frame
+        key = self._frame_key()
+        if key != self._flag_key:
+            memory = self._memory_snapshot()
+            for name, (address, size) in TRACKED_FLAGS.items():
+                self.flag_trackers[name].update(memory[address : address + size])
+            self._flag_key = key
+        return self.flag_trackers
+
+    def new_events(self) -> set[int]:
+        # Event flag numbers triggered since the start of the episode
+        return self._update_flag_trackers()["events"].episode_flags
+
+    @frame_cached
     def _get_location(self) -> dict[str, any]:
-        x_pos = self._read_m(0xD362)
-        y_pos = self._read_m(0xD361)
-        map_n = self._read_m(0xD35E)
+        ram = self._decode_ram()
+        x_pos = ram["x"]
+        y_pos = ram["y"]
+        map_n = ram["map_id"]
 
         return {
             "x": x_pos,
@@ -126,10 +299,10 @@ class PokemonEnvironment(PyboyEnvironment):
         }
 
     def _get_party_size(self) -> int:
-        return self._read_m(0xD163)
+        return self._decode_ram()["party_size"]
 
     def _get_badge_count(self) -> int:
-        return self._bit_count(self._read_m(0xD356))
+        return self._decode_ram()["badges"]
 
     def _is_grass_tile(self) -> bool:
         grass_tile_index = self._read_m(0xD535)
@@ -143,143 +316,130 @@ class PokemonEnvironment(PyboyEnvironment):
         return 0
 
     def _read_party_id(self) -> list[int]:
-        # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/pokemon_constants.asm
-        return [
-            self._read_m(addr)
-            for addr in [0xD164, 0xD165, 0xD166, 0xD167, 0xD168, 0xD169]
-        ]
+        return self._decode_ram()["party_id"].tolist()
 
     def _read_party_type(self) -> list[int]:
-        # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/type_constants.asm
-        return [
-            self._read_m(addr)
-            for addr in [
-                0xD170,
-                0xD171,
-                0xD19C,
-                0xD19D,
-                0xD1C8,
-                0xD1C9,
-                0xD1F4,
-                0xD1F5,
-                0xD220,
-                0xD221,
-                0xD24C,
-                0xD24D,
-            ]
-        ]
+        return self._decode_ram()["party_type"].tolist()
 
     def _read_party_level(self) -> list[int]:
-        return [
-            self._read_m(addr)
-            for addr in [0xD18C, 0xD1B8, 0xD1E4, 0xD210, 0xD23C, 0xD268]
-        ]
+        return self._decode_ram()["party_level"].tolist()
 
     def _read_party_status(self) -> list[int]:
-        # https://github.com/pret/pokered/blob/91dc3c9f9c8fd529bb6e8307b58b96efa0bec67e/constants/status_constants.asm
-        return [
-            self._read_m(addr)
-            for addr in [0xD16F, 0xD19B, 0xD1C7, 0xD1F3, 0xD21F, 0xD24B]
-        ]
+        return self._decode_ram()["party_status"].tolist()
 
     def _read_party_hp(self) -> dict[str, list[int]]:
-        hp = [
-            self._read_hp(addr)
-            for addr in [0xD16C, 0xD198, 0xD1C4, 0xD1F0, 0xD21C, 0xD248]
-        ]
-        max_hp = [
-            self._read_hp(addr)
-            for addr in [0xD18D, 0xD1B9, 0xD1E5, 0xD211, 0xD23D, 0xD269]
-        ]
-        return {"current": hp, "max": max_hp}
+        ram = self._decode_ram()
+        return {
+            "current": ram["party_hp"].tolist(),
+            "max": ram["party_max_hp"].tolist(),
+        }
 
     def _read_party_xp(self) -> list[int]:
-        return [
-            self._read_triple(addr)
-            for addr in [0xD179, 0xD1A5, 0xD1D1, 0xD1FD, 0xD229, 0xD255]
-        ]
+        return self._decode_ram()["party_xp"].tolist()
 
     def _read_hp(self, start: int) -> int:
         return 256 * self._read_m(start) + self._read_m(start + 1)
 
     def _read_caught_pokemon_count(self) -> int:
-        return sum(
-            list(self._bit_count(self._read_m(i)) for i in range(0xD2F7, 0xD30A))
-        )
+        return self._decode_ram()["caught_pokemon"]
 
     def _read_seen_pokemon_count(self) -> int:
-        return sum(
-            list(self._bit_count(self._read_m(i)) for i in range(0xD30A, 0xD31D))
-        )
+        return self._decode_ram()["seen_pokemon"]
 
     def _read_money(self) -> int:
-        return (
-            100 * 100 * self._read_bcd(self._read_m(0xD347))
-            + 100 * self._read_bcd(self._read_m(0xD348))
-            + self._read_bcd(self._read_m(0xD349))
-        )
+        return self._decode_ram()["money"]
 
     def _read_events(self) -> list[int]:
-        event_flags_start = 0xD747
-        event_flags_end = 0xD886
         # museum_ticket = (0xD754, 0)
         # base_event_flags = 13
-        return [
-            self._bit_count(self._read_m(i))
-            for i in range(event_flags_start, event_flags_end)
-        ]
-
-    def _get_screen_background_tilemap(self):
-        ### SIMILAR TO CURRENT pyboy.game_wrapper()._game_area_np(), BUT ONLY FOR BACKGROUND TILEMAP, SO NPC ARE SKIPPED
-        bsm = self.pyboy.botsupport_manager()
-        ((scx, scy), (wx, wy)) = bsm.screen().tilemap_position()
-        tilemap = np.array(bsm.tilemap_background()[:, :])
-        return np.roll(np.roll(tilemap, -scy // 8, axis=0), -scx // 8, axis=1)[:18, :20]
-
-    def _get_screen_walkable_matrix(self):
-        walkable_tiles_indexes = []
-        collision_ptr = self.pyboy.get_memory_value(0xD530) + (
-            self.pyboy.get_memory_value(0xD531) << 8
-        )
-        tileset_type = self.pyboy.get_memory_value(0xFFD7)
-        if tileset_type > 0:
-            grass_tile_index = self.pyboy.get_memory_value(0xD535)
+        return self._decode_ram()["events"].tolist()
+
+    # Dense 0/1 flag vectors, e.g. for observations - views into the decoded RAM, copy them to keep them
+
+    def _read_caught_flags(self) -> np.ndarray:
+        return self._decode_ram()["caught_flags"]
+
+    def _read_seen_flags(self) -> np.ndarray:
+        return self._decode_ram()["seen_flags"]
+
+    def _read_event_flags(self) -> np.ndarray:
+        return self._decode_ram()["event_flags"]
+
+    def _read_event_flag(self, address: int, bit: int) -> bool:
+        return self._read_bit(address, bit)
+
+    def _get_screen_background_tilemap(self) -> np.ndarray:
+        ### SIMILAR TO pyboy.game_wrapper.game_area(), BUT ONLY FOR BACKGROUND TILEMAP, SO NPC ARE SKIPPED
+        # Raw tile numbers as stored in VRAM, LCDC bit 3 selects the background map
+        lcdc = self.pyboy.memory[0xFF40]
+        offset = 0x9C00 if lcdc & 0x08 else 0x9800
+        # Filling the preallocated bytearray from the list is much cheaper than np.array
+        self._tilemap_bytes[:] = self.pyboy.memory[offset : offset + 0x400]
+        tilemap = self._tilemap
+
+        # Visible 18x20 window of the wrapping 32x32 map, cropped with one gather
+        scy = self.pyboy.memory[0xFF42]
+        scx = self.pyboy.memory[0xFF43]
+        rows = (scy // 8 + _SCREEN_TILE_ROWS) % 32
+        cols = (scx // 8 + _SCREEN_TILE_COLS) % 32
+        return tilemap[np.ix_(rows, cols)]
+
+    def _get_walkable_tiles(self) -> np.ndarray:
+        # 256 entry lookup of walkable tile numbers, the collision list only changes with the tileset
+        tileset_type = self._read_m(0xFFD7)
+        collision_ptr = self._read_m(0xD530) + (self._read_m(0xD531) << 8)
+        grass_tile_index = self._read_m(0xD535) if tileset_type > 0 else 0xFF
+
+        key = (tileset_type, collision_ptr, grass_tile_index)
+        walkable = self._walkable_tiles_cache.get(key)
+        if walkable is None:
+            walkable = np.zeros(256, dtype=np.uint8)
             if grass_tile_index != 0xFF:
-                walkable_tiles_indexes.append(grass_tile_index + 0x100)
-        for i in range(0x180):
-            tile_index = self.pyboy.get_memory_value(collision_ptr + i)
-            if tile_index == 0xFF:
-                break
-            else:
-                walkable_tiles_indexes.append(tile_index + 0x100)
+                walkable[grass_tile_index] = 1
+
+            # The list of walkable tiles is terminated by 0xFF
+            collision_tiles = np.array(
+                self.pyboy.memory[collision_ptr : collision_ptr + 0x180], dtype=np.uint8
+            )
+            end = np.flatnonzero(collision_tiles == 0xFF)
+            if len(end) > 0:
+                collision_tiles = collision_tiles[: end[0]]
+            walkable[collision_tiles] = 1
+
+            self._walkable_tiles_cache[key] = walkable
+        return walkable
+
+    def collision_cache_info(self) -> dict[str, int]:
+        return {"hits": self.collision_cache_hits, "misses": self.collision_cache_misses}
+
+    def _get_screen_walkable_matrix(self) -> np.ndarray:
         screen_tiles = self._get_screen_background_tilemap()
-        bottom_left_screen_tiles = screen_tiles[1 : 1 + screen_tiles.shape[0] : 2, ::2]
-        walkable_matrix = np.isin(
-            bottom_left_screen_tiles, walkable_tiles_indexes
-        ).astype(np.uint8)
-        return walkable_matrix
-
-    def game_area_collision(self):
-        shape = (20, 18)
-        game_area_section = (0, 0) + shape
-        width = game_area_section[2]
-        height = game_area_section[3]
-
-        game_area = np.ndarray(shape=(height, width), dtype=np.uint32)
+        # Collision is decided by the bottom left tile of every 2x2 block
+        bottom_left_screen_tiles = screen_tiles[1::2, ::2]
+        return self._get_walkable_tiles()[bottom_left_screen_tiles]
+
+    @frame_cached(counter="collision_cache")
+    def game_area_collision(self) -> np.ndarray:
+        """
+        18x20 walkable map of the screen, 1 where the player can walk. The array is reused between frames, copy it to
+        keep it.
+        """
         _collision = self._get_screen_walkable_matrix()
-        for i in range(height // 2):
-            for j in range(width // 2):
-                game_area[i * 2][j * 2 : j * 2 + 2] = _collision[i][j]
-                game_area[i * 2 + 1][j * 2 : j * 2 + 2] = _collision[i][j]
-        return game_area
+
+        # Upsample every 2x2 block by broadcasting into the preallocated output
+        blocks = self._collision_area.reshape(9, 2, 10, 2)
+        blocks[...] = _collision[:, None, :, None]
+        return self._collision_area
 
     # Note: These are all examples of rewards we can calculate based on the stats, you can implement and modify your own as you please
 
-    def _caught_reward(self, new_state: dict[str, any]) -> int:
-        return new_state["caught_pokemon"] - self.prior_game_stats["caught_pokemon"]
+    # The flag rewards are the changes between the prior stats and the current frame, tracked as the stats are
+    # generated - `new_state` is ignored and only accepted so older reward functions passing it keep working
+    def _caught_reward(self, new_state: dict[str, any] = None) -> int:
+        return self.flag_trackers["caught"].net_change
 
-    def _seen_reward(self, new_state: dict[str, any]) -> int:
-        return new_state["seen_pokemon"] - self.prior_game_stats["seen_pokemon"]
+    def _seen_reward(self, new_state: dict[str, any] = None) -> int:
+        return self.flag_trackers["seen"].net_change
 
     def _health_reward(self, new_state: dict[str, any]) -> int:
         return sum(new_state["hp"]["current"]) - sum(
@@ -298,5 +458,5 @@ class PokemonEnvironment(PyboyEnvironment):
     def _money_reward(self, new_state: dict[str, any]) -> int:
         return new_state["money"] - self.prior_game_stats["money"]
 
-    def _event_reward(self, new_state: dict[str, any]) -> int:
-        return sum(new_state["events"]) - sum(self.prior_game_stats["events"])
\ No newline at end of file
+    def _event_reward(self, new_state: dict[str, any] = None) -> int:
+        return self.flag_trackers["events"].net_change
@@ -7,16 +7,16 @@ from pyboy_environment.environments.pokemon.pokemon_environment import (
     PokemonEnvironment,
 )
 from pyboy_environment.environments.pokemon import pokemon_constants as pkc
-from PIL import Image
+from pyboy_environment.environments.pokemon.visit_index import VisitIndex
 
 import math as mt
 
 
-import cv2 as cv
-
-
 class PokemonBrock(PokemonEnvironment):
-    def __init__(self, act_freq: int, emulation_speed: int = 0, headless: bool = False,) -> None:
+    # Layout of the stats vector at the start of _get_state, followed by the flattened game area
+    state_fields = ("level", "type_id", "hp", "xp", "badges", "money", "x", "y", "map_id")
+
+    def __init__(self, act_freq: int, emulation_speed: int = 0, headless: bool = False, backend: str = "pyboy",) -> None:
 
         valid_actions: list[WindowEvent] = [
             WindowEvent.PRESS_ARROW_DOWN,
@@ -46,6 +46,7 @@ class PokemonBrock(PokemonEnvironment):
             valid_actions=valid_actions,
             release_button=release_button,
             headless=headless,
+            backend=backend,
         )
 
         self.current_hp = 0
@@ -55,12 +56,12 @@ class PokemonBrock(PokemonEnvironment):
         self.current_money = 0
         self.x = 0
         self.y = 0
-        self.locations = {}
-        self.rooms = []
+        # Positions visited this episode and over all episodes, a visit counts as new 1.5 / 3.5 tiles away
+        self.locations = VisitIndex(radius=1.5)
+        self.rooms = set()
         self.position_history = []
         self.previous_position = (0, 0)
-        self.all_previous_positions = {}
-        self.all_previous_maps = []
+        self.all_previous_positions = VisitIndex(radius=3.5)
         self.total_distance = 0
         self.total_scoring = 0
         self.previous_position_from_origin = 0
@@ -111,23 +112,29 @@ class PokemonBrock(PokemonEnvironment):
         self.select_presses = 0
         self.other_presses = 0
 
+    @cached_property
+    def observation_space(self) -> int:
+        # Sized from the layout, so no emulator step is required
+        return len(self.state_fields) + int(np.prod(self.game_area_shape))
+
     def _get_state(self) -> np.ndarray:
         game_stats = self._generate_game_stats()
         game_location = self._get_location()
         game_area = np.array(self.game_area()).ravel()
 
-        levels = np.array(game_stats["levels"])
-        type_id = np.array(game_stats["type_id"])
-        hp = np.array(game_stats["hp"]["current"]).sum()
-        xp = np.array(game_stats["xp"])
-        badges = game_stats["badges"]
-        money = game_stats["money"]
-        x = game_location['x']
-        y = game_location['y']
-        map_id = game_location['map_id']
-
-        state_vector = np.array(
-            [levels[0], type_id[0], hp, xp[0], badges, money, x, y, map_id])
+        stats = {
+            "level": game_stats["levels"][0],
+            "type_id": game_stats["type_id"][0],
+            "hp": np.array(game_stats["hp"]["current"]).sum(),
+            "xp": game_stats["xp"][0],
+            "badges": game_stats["badges"],
+            "money": game_stats["money"],
+            "x": game_location['x'],
+            "y": game_location['y'],
+            "map_id": game_location['map_id'],
+        }
+
+        state_vector = np.array([stats[name] for name in self.state_fields])
         return np.concatenate((state_vector, game_area))
 
     def _calculate_reward(self, new_state: dict) -> float:
@@ -210,9 +217,9 @@ class PokemonBrock(PokemonEnvironment):
         current_badges = game_stats["badges"]
         current_money = game_stats["money"]
 
-        total_score += self._caught_reward(new_state)
-        total_score += self._seen_reward(new_state)
-        total_score += self._event_reward(new_state)
+        total_score += self._caught_reward()
+        total_score += self._seen_reward()
+        total_score += self._event_reward()
 
         # Score changes in levels, HP, XP, badges, and money
         if current_levels_sum > self.current_level:
@@ -249,47 +256,15 @@ class PokemonBrock(PokemonEnvironment):
         if len(self.position_history) > 10:  # Limit history size to last 10 positions
             self.position_history.pop(0)
 
-        under_flag = False
-
-        if map_id not in self.rooms:
-            self.rooms.append(map_id)
-            self.locations[map_id] = [current_position]
-        else:
-            map_locations = self.locations.get(map_id, [])
-
-            for (x, y) in map_locations:
-                distance = mt.sqrt(
-                    (x - current_position[0])**2 + (y - current_position[1])**2)
+        self.rooms.add(map_id)
+        self.locations.visit(map_id, x, y)
 
-                if distance <= 1.5:
-                    under_flag = True
-                    break
-
-            if not under_flag:
-                self.locations[map_id].append(current_position)
-                # print("location found")
-
-        under_flag = False
-
-        if map_id not in self.all_previous_maps:
-            self.all_previous_maps.append(map_id)
-            self.all_previous_positions[map_id] = [current_position]
+        if map_id not in self.all_previous_positions:
+            self.all_previous_positions.visit(map_id, x, y)
             total_score += 10
             # print("New map found")
-        else:
-            map_locations = self.all_previous_positions.get(map_id, [])
-
-            for (x, y) in map_locations:
-                distance = mt.sqrt(
-                    (x - current_position[0])**2 + (y - current_position[1])**2)
-
-                if distance <= 3.5:
-                    under_flag = True
-                    break
-
-            if not under_flag:
-                self.all_previous_positions[map_id].append(current_position)
-                total_score += 5
+        elif self.all_previous_positions.visit(map_id, x, y):
+            total_score += 5
         
         current_position_from_origin = mt.sqrt(current_position[0]**2 + current_position[1]**2)
 
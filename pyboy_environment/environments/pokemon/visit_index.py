@@ -0,0 +1,68 @@
+"""
+Per map spatial index of visited positions.
+
+Instead of keeping every visited position and scanning them for one within `radius`, each visit stamps the disc of
+tiles within `radius` of it into a dense coverage bitmap of the map. "Is there a visited position within radius r of
+(x, y)" is then the single lookup bitmap[y, x], and memory is bounded by one 256x256 bitmap per map since positions
+are stored as single bytes in RAM.
+"""
+
+import numpy as np
+
+MAP_SIZE = 256
+
+
+class VisitIndex:
+    def __init__(self, radius: float) -> None:
+        self.radius = radius
+
+        # Offsets of every tile within radius of the origin
+        reach = int(np.floor(radius))
+        dy, dx = np.mgrid[-reach : reach + 1, -reach : reach + 1]
+        inside = dx * dx + dy * dy <= radius * radius
+        self.offsets_y = dy[inside]
+        self.offsets_x = dx[inside]
+
+        self.bitmaps: dict[int, np.ndarray] = {}
+        self.visited_maps: set[int] = set()
+        self.point_count = 0
+
+    def covered(self, map_id: int, x: int, y: int) -> bool:
+        # True when a visited position on the map is within radius of (x, y)
+        if map_id not in self.visited_maps:
+            return False
+        return bool(self.bitmaps[map_id][y, x])
+
+    def visit(self, map_id: int, x: int, y: int) -> bool:
+        """
+        Records (x, y) unless a visited position within radius already covers it. Returns True for a new position.
+        """
+        if self.covered(map_id, x, y):
+            return False
+
+        bitmap = self.bitmaps.get(map_id)
+        if bitmap is None:
+            bitmap = np.zeros((MAP_SIZE, MAP_SIZE), dtype=np.bool_)
+            self.bitmaps[map_id] = bitmap
+        self.visited_maps.add(map_id)
+
+        ys = y + self.offsets_y
+        xs = x + self.offsets_x
+        valid = (ys >= 0) & (ys < MAP_SIZE) & (xs >= 0) & (xs < MAP_SIZE)
+        bitmap[ys[valid], xs[valid]] = True
+
+        self.point_count += 1
+        return True
+
+    def clear(self) -> None:
+        # Bitmaps are zeroed and reused rather than reallocated
+        for map_id in self.visited_maps:
+            self.bitmaps[map_id].fill(False)
+        self.visited_maps.clear()
+        self.point_count = 0
+
+    def __contains__(self, map_id: int) -> bool:
+        return map_id in self.visited_maps
+
+    def __len__(self) -> int:
+        return len(self.visited_maps)
@@ -0,0 +1,84 @@
+"""
+Lightweight per-phase wall time recording for PyboyEnvironment.step.
+
+Each phase keeps a running count and total plus a fixed size ring buffer of the most recent samples, which is used for
+the rolling percentiles. Recording a sample is a couple of array writes, nothing is allocated on the hot path.
+"""
+
+import csv
+import json
+from pathlib import Path
+
+import numpy as np
+
+STEP_PHASES = (
+    "_run_action_on_emulator",
+    "_get_state",
+    "_generate_game_stats",
+    "_calculate_reward",
+    "_check_if_done",
+    "_check_if_truncated",
+    "step",
+)
+
+
+class PhaseTimer:
+    def __init__(self, phases: tuple[str, ...] = STEP_PHASES, window: int = 1024):
+        self.phases = phases
+        self.window = window
+
+        self.counts = {phase: 0 for phase in phases}
+        self.totals = {phase: 0.0 for phase in phases}
+        self.samples = {phase: np.zeros(window, dtype=np.float64) for phase in phases}
+
+    def record(self, phase: str, seconds: float) -> None:
+        count = self.counts[phase]
+        self.samples[phase][count % self.window] = seconds
+        self.counts[phase] = count + 1
+        self.totals[phase] += seconds
+
+    def clear(self) -> None:
+        for phase in self.phases:
+            self.counts[phase] = 0
+            self.totals[phase] = 0.0
+
+    def percentiles(self, phase: str) -> dict[str, float]:
+        count = min(self.counts[phase], self.window)
+        if count == 0:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+
+        p50, p95, p99 = np.percentile(self.samples[phase][:count], [50, 95, 99])
+        return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        summary = {}
+        for phase in self.phases:
+            count = self.counts[phase]
+            total = self.totals[phase]
+            summary[phase] = {
+                "count": count,
+                "total": total,
+                "mean": total / count if count > 0 else 0.0,
+                **self.percentiles(phase),
+            }
+        return summary
+
+    def dump(self, path: str) -> None:
+        # The format follows the file extension - .csv or .json
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+
+        if path.suffix == ".csv":
+            with open(path, "w", encoding="utf-8", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(
+                    ["phase", "count", "total", "mean", "p50", "p95", "p99"]
+                )
+                for phase, stats in summary.items():
+                    writer.writerow([phase] + list(stats.values()))
+        elif path.suffix == ".json":
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=4)
+        else:
+            raise ValueError(f"Unknown phase timing dump format: {path.suffix}")
@@ -1,13 +1,81 @@
+import io
+import os
+import time
 from abc import ABCMeta, abstractmethod
-from functools import cached_property
+from functools import cached_property, partial, wraps
 from pathlib import Path
 
-import cv2
 import numpy as np
-from pyboy import PyBoy
+from pyboy_environment.environments.bitfield import POPCOUNT
+from pyboy_environment.environments.backends import (
+    SCREEN_COLS,
+    SCREEN_ROWS,
+    EmulatorBackend,
+    StubBackend,
+    make_backend,
+)
+from pyboy_environment.environments.image_observation import ImageObservation
+from pyboy_environment.environments.profiling import PhaseTimer
+from pyboy_environment.environments.ram_schema import RamSchema
+
+# Init states are read from disk once per process and shared by every environment using them
+_init_state_cache: dict[tuple[str, str], bytes] = {}
+
+
+def load_init_state(domain: str, init_state_file_name: str, init_path: str) -> bytes:
+    key = (domain, init_state_file_name)
+    if key not in _init_state_cache:
+        with open(init_path, "rb") as f:
+            _init_state_cache[key] = f.read()
+    return _init_state_cache[key]
+
+
+def clear_init_state_cache() -> None:
+    _init_state_cache.clear()
+
+
+def frame_cached(method=None, *, counter: str = "stats_cache"):
+    """
+    Memoises a method for the current emulated frame, the cache is dropped after a tick or a state load. Hits and
+    misses are counted in the `<counter>_hits` and `<counter>_misses` attributes, the game stats ones by default.
+    """
+    if method is None:
+        return partial(frame_cached, counter=counter)
+
+    cache_name = f"_{method.__name__}_cache"
+    hits_name = f"{counter}_hits"
+    misses_name = f"{counter}_misses"
+
+    @wraps(method)
+    def wrapper(self):
+        key = self._frame_key()
+        cached = self.__dict__.get(cache_name)
+        if cached is not None and cached[0] == key:
+            setattr(self, hits_name, getattr(self, hits_name) + 1)
+        else:
+            setattr(self, misses_name, getattr(self, misses_name) + 1)
+            cached = (key, method(self))
+            self.__dict__[cache_name] = cached
+
+        # Shallow copy so callers adding keys to the result do not change the cached record
+        result = cached[1]
+        return dict(result) if isinstance(result, dict) else result
+
+    return wrapper
 
 
 class PyboyEnvironment(metaclass=ABCMeta):
+    # Address ranges copied into the RAM snapshot on each step - WRAM and HRAM
+    snapshot_regions: tuple[tuple[int, int], ...] = (
+        (0xC000, 0xE000),
+        (0xFF80, 0x10000),
+    )
+
+    # Declarative layout of the game stats in RAM, decoded from the snapshot in one pass
+    ram_schema: RamSchema | None = None
+
+    # Rows and columns of game_area()
+    game_area_shape: tuple[int, int] = (32, 32)
 
     def __init__(
         self,
@@ -20,6 +88,7 @@ class PyboyEnvironment(metaclass=ABCMeta):
         release_button: list,
         emulation_speed: int = 0,
         headless: bool = False,
+        backend: str | EmulatorBackend = "pyboy",
     ) -> None:
         self.task = task
         self.domain = domain
@@ -28,6 +97,7 @@ class PyboyEnvironment(metaclass=ABCMeta):
         path = f"{Path.home()}/cares_rl_configs/{self.domain}"
         self.rom_path = f"{path}/{rom_name}"
         self.init_path = f"{path}/task_init_states/{init_state_file_name}"
+        self.init_state_file_name = init_state_file_name
 
         self.combo_actions = 0
 
@@ -37,81 +107,417 @@ class PyboyEnvironment(metaclass=ABCMeta):
 
         self.act_freq = act_freq
 
-        head = "null" if headless else "SDL2"
-        self.pyboy = PyBoy(
-            self.rom_path,
-            window=head,
-        )
-
-        self.prior_game_stats = self._generate_game_stats()
-        self.screen = self.pyboy.screen
+        self.headless = headless
+
+        # When batching, the frames of an action run in one tick call and only the last one is rendered.
+        # Headless runs only need a rendered frame when the screen is read (image observations or grab_frame).
+        self.batch_ticks = headless
+        self.render_frames = not headless
+
+        # One snapshot of the RAM per emulated frame, _read_m indexes into it instead of the emulator
+        self._memory_bytes = bytearray(0x10000)
+        self._memory = np.frombuffer(self._memory_bytes, dtype=np.uint8)
+        self._snapshot_mask = bytearray(0x10000)
+        for start, end in self.snapshot_regions:
+            self._snapshot_mask[start:end] = b"\x01" * (end - start)
+        self._snapshot_key = None
+        self._decoded_ram = None
+        self._decoded_key = None
+        if self.ram_schema is not None:
+            for group in self.ram_schema.groups:
+                missing = [
+                    hex(addr)
+                    for addr in group.indices.ravel()
+                    if not self._snapshot_mask[addr]
+                ]
+                if missing:
+                    raise ValueError(
+                        f"RAM schema reads addresses outside the snapshot regions: {missing}"
+                    )
+        # Bumped whenever a state is loaded, the frame counter alone does not change on load_state
+        self._state_epoch = 0
+
+        # Snapshot and decoding timing metrics in seconds
+        self.snapshot_time = 0.0
+        self.snapshot_count = 0
+        self.decode_time = 0.0
+        self.decode_count = 0
+
+        # Hit/miss counters for the methods memoised per frame with frame_cached
+        self.stats_cache_hits = 0
+        self.stats_cache_misses = 0
+
+        # The emulator is booted on first use, see the pyboy property
+        self.backend = backend
+        self.emulation_speed = emulation_speed
+        self._pyboy = None
+
+        self.prior_game_stats = None
+
+        # Pixel observations, see enable_image_observation
+        self.image_observation = None
+        self.image_observation_config = None
 
         self.steps = 0
         self.total_steps_done = 0
 
+        # Opt-in per-phase timing of step, see enable_profiling
+        self.phase_timer = None
+        self.profiling_dump_path = None
+        self.episode_count = 0
+
+        # Reset latency metrics in seconds
+        self.reset_latency = 0.0
+        self.total_reset_time = 0.0
+        self.reset_count = 0
+
         self.seed = 0
 
-        self.pyboy.set_emulation_speed(emulation_speed)
+    @property
+    def pyboy(self) -> EmulatorBackend:
+        if self._pyboy is None:
+            self._boot()
+        return self._pyboy
+
+    @property
+    def screen(self):
+        return self.pyboy.screen
+
+    def _boot(self) -> None:
+        # Starts the emulator in the task's initial state - done lazily so constructing an environment is cheap
+        if self.backend is None:
+            raise RuntimeError("The environment's emulator was released")
+
+        self._pyboy = make_backend(
+            self.backend,
+            self.rom_path,
+            self.headless,
+            game_area_shape=self.game_area_shape,
+        )
+        self._pyboy.set_emulation_speed(self.emulation_speed)
+
+        self._load_state(io.BytesIO(self._init_state()))
+        self.prior_game_stats = self._generate_game_stats()
 
-        self.reset()
+    def release_emulator(self) -> EmulatorBackend | None:
+        """
+        Detaches and returns the emulator, e.g. to hand it to another environment. The environment can not be used
+        afterwards.
+        """
+        pyboy = self._pyboy
+        self._pyboy = None
+        self.backend = None
+        return pyboy
 
     def set_seed(self, seed: int) -> None:
         self.seed = seed
         # There isn't a random element to set that I am aware of...
 
     def reset(self) -> np.ndarray:
+        start_time = time.perf_counter()
+
+        if self.phase_timer is not None and self.steps > 0:
+            self._dump_phase_timings()
+        self.episode_count += 1
+
         self.steps = 0
 
-        with open(self.init_path, "rb") as f:
-            self.pyboy.load_state(f)
+        self._reset_emulator()
 
         self.prior_game_stats = self._generate_game_stats()
 
-        return self._get_state()
+        state = self._observe(reset=True)
+
+        self.reset_latency = time.perf_counter() - start_time
+        self.total_reset_time += self.reset_latency
+        self.reset_count += 1
+
+        return state
+
+    def _reset_emulator(self) -> None:
+        # Puts the emulator in the state episodes start from
+        self._load_state(io.BytesIO(self._init_state()))
+
+    def _init_state(self) -> bytes:
+        if isinstance(self.pyboy, StubBackend) and not os.path.isfile(self.init_path):
+            # The stub backend runs without the ROM configs and starts from its own initial RAM
+            return b""
+        return load_init_state(self.domain, self.init_state_file_name, self.init_path)
+
+    def mean_reset_latency(self) -> float:
+        if self.reset_count == 0:
+            return 0.0
+        return self.total_reset_time / self.reset_count
 
     def grab_frame(self, height: int = 240, width: int = 300) -> np.ndarray:
-        frame = np.array(self.screen.image)
+        import cv2
+
+        if self.render_frames:
+            frame = np.array(self.screen.image)
+        else:
+            frame = self._render_frame()
         frame = cv2.resize(frame, (width, height))
         # Convert to BGR for use with OpenCV
         frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
         return frame
     
+    def _render_frame(self) -> np.ndarray:
+        """
+        Screen of the current state when frames are not being rendered. PyBoy only renders while ticking, so this
+        renders the next frame and then puts the emulator back, so stepping is not affected.
+        """
+        state = self._save_state()
+        self.pyboy.tick(1, True)
+        # Copied before the load restores the old screen buffer
+        frame = np.array(self.screen.image)
+
+        self._load_state(io.BytesIO(state))
+        if self.current_action is not None:
+            self._restore_pending_inputs(self.current_action)
+        return frame
+
+    def enable_image_observation(
+        self, scale: int = 2, grayscale: bool = True, stack: int = 4
+    ) -> None:
+        """
+        Switches the observation to the screen pixels, downsampled by `scale` and stacked over the last `stack` steps.
+        Observations have shape (stack, rows, cols), or (stack, rows, cols, 3) in colour, and are uint8 views that are
+        overwritten on the next step.
+        """
+        self.image_observation_config = {
+            "scale": scale,
+            "grayscale": grayscale,
+            "stack": stack,
+        }
+        self.image_observation = None
+        self.render_frames = True
+
+        rows = -(-SCREEN_ROWS // scale)
+        cols = -(-SCREEN_COLS // scale)
+        channels = 1 if grayscale else 3
+        # Replaces the subclass's cached observation_space
+        self.__dict__["observation_space"] = stack * rows * cols * channels
+
+    def disable_image_observation(self) -> None:
+        self.image_observation = None
+        self.image_observation_config = None
+        self.render_frames = not self.headless
+        self.__dict__.pop("observation_space", None)
+
+    def _get_image_state(self, reset: bool = False) -> np.ndarray:
+        if self.image_observation is None:
+            self.image_observation = ImageObservation(
+                self.screen.ndarray, **self.image_observation_config
+            )
+            reset = True
+
+        if reset:
+            return self.image_observation.reset()
+        return self.image_observation.update()
+
+    def _observe(self, reset: bool = False) -> np.ndarray:
+        if self.image_observation_config is not None:
+            return self._get_image_state(reset)
+        return self._get_state()
+
     def grab_action(self):
         return self.current_action
 
     def game_area(self) -> np.ndarray:
         return self.pyboy.game_area()
 
+    def enable_profiling(self, window: int = 1024, dump_path: str = None) -> None:
+        """
+        Records the wall time of each phase of step. When dump_path is set the timings of every episode are written
+        on reset to dump_path formatted with the episode number, e.g. "timings/episode_{episode}.csv".
+        """
+        self.phase_timer = PhaseTimer(window=window)
+        self.profiling_dump_path = dump_path
+
+    def disable_profiling(self) -> None:
+        self.phase_timer = None
+        self.profiling_dump_path = None
+
+    def phase_timings(self) -> dict[str, dict[str, float]]:
+        if self.phase_timer is None:
+            return {}
+        return self.phase_timer.summary()
+
+    def _dump_phase_timings(self) -> None:
+        if self.profiling_dump_path is not None:
+            self.phase_timer.dump(
+                self.profiling_dump_path.format(episode=self.episode_count)
+            )
+            self.phase_timer.clear()
+
     def step(self, action) -> tuple:
+        return self._step(action)
+
+    def step_many(self, actions, step_callback=None) -> tuple:
+        """
+        Runs a sequence of actions in one call. Every step computes the game stats, reward, done and truncated as
+        step does - these only read the RAM snapshot of the step - but the vector observation is only built after the
+        last action. Image observations still take a frame every step for the stack. Stops at the first step that is
+        done or truncated. `step_callback` is called with the action after each step, recorders use it to see every
+        step.
+
+        Returns (state, summed reward, dones, truncateds) with one done/truncated flag per step that was run.
+        """
+        state = None
+        total_reward = 0.0
+        dones = []
+        truncateds = []
+        for action in actions:
+            state, reward, done, truncated = self._step(action, observe=False)
+            total_reward += reward
+            dones.append(done)
+            truncateds.append(truncated)
+
+            if step_callback is not None:
+                step_callback(action)
+
+            if done or truncated:
+                break
+
+        if state is None:
+            state = self._observe()
+
+        return (
+            state,
+            total_reward,
+            np.array(dones, dtype=np.bool_),
+            np.array(truncateds, dtype=np.bool_),
+        )
+
+    def _on_step(self, action, reward: float) -> None:
+        # Called after every step once the reward and flags are computed
+        pass
+
+    def _step(self, action, observe: bool = True) -> tuple:
+        """
+        Body of step and step_many. Without `observe` the vector observation is skipped and None returned in its
+        place, image observations are always updated. Every phase is timed while profiling.
+        """
+        timer = self.phase_timer
+        step_start = time.perf_counter()
+
         self.steps += 1
         self.total_steps_done += 1
 
         self.current_action = action
 
-        self._run_action_on_emulator(action)
-
-        state = self._get_state()
+        self._timed("_run_action_on_emulator", self._run_action_on_emulator, action)
 
-        current_game_stats = self._generate_game_stats()
-        reward = self._calculate_reward(current_game_stats)
+        state = None
+        if observe or self.image_observation_config is not None:
+            state = self._timed("_get_state", self._observe)
 
-        done = self._check_if_done(current_game_stats)
-        truncated = self._check_if_truncated(current_game_stats)
+        current_game_stats = self._timed(
+            "_generate_game_stats", self._generate_game_stats
+        )
+        reward = self._timed(
+            "_calculate_reward", self._calculate_reward, current_game_stats
+        )
+        done = self._timed("_check_if_done", self._check_if_done, current_game_stats)
+        truncated = self._timed(
+            "_check_if_truncated", self._check_if_truncated, current_game_stats
+        )
 
         self.prior_game_stats = current_game_stats
 
+        self._on_step(action, reward)
+
+        if timer is not None:
+            timer.record("step", time.perf_counter() - step_start)
+
         return state, reward, done, truncated
 
+    def _timed(self, phase: str, method, *args):
+        # Calls method, recording its wall time under phase while profiling
+        if self.phase_timer is None:
+            return method(*args)
+
+        start = time.perf_counter()
+        result = method(*args)
+        self.phase_timer.record(phase, time.perf_counter() - start)
+        return result
+
+    def _tick_emulator(self, frames: int) -> None:
+        if self.batch_ticks:
+            self.pyboy.tick(frames, self.render_frames)
+        else:
+            for _ in range(frames):
+                self.pyboy.tick()
+
+    def _restore_pending_inputs(self, action) -> None:
+        """
+        Re-sends the inputs that `_run_action_on_emulator(action)` queued after its last tick. Savestates do not include
+        queued inputs, so this is called after restoring a state saved right after that action.
+        """
+
+    def _load_state(self, file_like_object) -> None:
+        self.pyboy.load_state(file_like_object)
+        self._state_epoch += 1
+
+    def _save_state(self) -> bytes:
+        state = io.BytesIO()
+        self.pyboy.save_state(state)
+        return state.getvalue()
+
+    def _frame_key(self) -> tuple[int, int]:
+        return (self.pyboy.frame_count, self._state_epoch)
+
+    def _memory_snapshot(self) -> np.ndarray:
+        key = self._frame_key()
+        if key != self._snapshot_key:
+            start_time = time.perf_counter()
+            for start, end in self.snapshot_regions:
+                # Filling the bytearray from the list is much cheaper than converting it through NumPy
+                self._memory_bytes[start:end] = self.pyboy.memory[start:end]
+            self._snapshot_key = key
+            self.snapshot_time += time.perf_counter() - start_time
+            self.snapshot_count += 1
+        return self._memory
+
+    def _decode_ram(self) -> dict:
+        key = self._frame_key()
+        if key != self._decoded_key:
+            memory = self._memory_snapshot()
+            start_time = time.perf_counter()
+            self._decoded_ram = self.ram_schema.decode(memory)
+            self._decoded_key = key
+            self.decode_time += time.perf_counter() - start_time
+            self.decode_count += 1
+        return self._decoded_ram
+
+    def stats_cache_info(self) -> dict[str, int]:
+        return {"hits": self.stats_cache_hits, "misses": self.stats_cache_misses}
+
+    def memory_timings(self) -> dict[str, float]:
+        return {
+            "snapshot_time": self.snapshot_time,
+            "snapshot_count": self.snapshot_count,
+            "mean_snapshot_time": self.snapshot_time / max(self.snapshot_count, 1),
+            "decode_time": self.decode_time,
+            "decode_count": self.decode_count,
+            "mean_decode_time": self.decode_time / max(self.decode_count, 1),
+        }
+
     def _read_m(self, addr: int) -> int:
+        if self._snapshot_mask[addr]:
+            if self._snapshot_key != (self.pyboy.frame_count, self._state_epoch):
+                self._memory_snapshot()
+            return self._memory_bytes[addr]
         return self.pyboy.memory[addr]
 
     def _read_bit(self, addr: int, bit: int) -> bool:
-        # add padding so zero will read '0b100000000' instead of '0b0'
-        return bin(256 + self._read_m(addr))[-bit - 1] == "1"
+        return (self._read_m(addr) >> bit) & 1 == 1
 
-    # built-in since python 3.10
     def _bit_count(self, bits: int) -> int:
-        return bin(bits).count("1")
+        if bits < 256:
+            return int(POPCOUNT[bits])
+        # built-in since python 3.10
+        return bits.bit_count()
 
     def _read_triple(self, start_add: int) -> int:
         return (
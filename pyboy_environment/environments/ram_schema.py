@@ -0,0 +1,150 @@
+"""
+Declarative description of the game stats stored in RAM.
+
+A RamSchema is compiled once into NumPy index arrays. Fields sharing an encoding are gathered with a single fancy-index
+and decoded together, so decoding a full set of stats is a handful of array operations on the RAM snapshot instead of
+hundreds of scalar reads.
+
+Supported encodings:
+    u8       - raw bytes, `width` bytes per entry are returned flattened
+    u16      - big-endian 16 bit values
+    u24      - big-endian 24 bit values
+    bcd      - binary coded decimal over `width` bytes, most significant byte first
+    popcount - number of set bits over `width` bytes
+    bits     - flags expanded to one uint8 per bit, `width` * 8 entries per row (flag n is bit n % 8 of byte n // 8)
+"""
+
+import numpy as np
+
+from pyboy_environment.environments.bitfield import POPCOUNT, unpack_flags
+
+_ENCODING_WIDTHS = {"u16": 2, "u24": 3}
+
+
+class RamField:
+    def __init__(
+        self,
+        name: str,
+        address: int,
+        encoding: str = "u8",
+        count: int = 1,
+        stride: int = 1,
+        width: int | None = None,
+    ) -> None:
+        if encoding not in ("u8", "u16", "u24", "bcd", "popcount", "bits"):
+            raise ValueError(f"Unknown RAM field encoding: {encoding}")
+
+        if width is None:
+            width = _ENCODING_WIDTHS.get(encoding, 1)
+        elif encoding in _ENCODING_WIDTHS and width != _ENCODING_WIDTHS[encoding]:
+            raise ValueError(
+                f"{encoding} fields are {_ENCODING_WIDTHS[encoding]} bytes wide"
+            )
+
+        self.name = name
+        self.address = address
+        self.encoding = encoding
+        self.count = count
+        self.stride = stride
+        self.width = width
+
+    @property
+    def scalar(self) -> bool:
+        # Single values are returned as Python ints rather than arrays
+        if self.encoding == "bits":
+            return False
+        return self.count == 1 and (self.encoding != "u8" or self.width == 1)
+
+    def addresses(self) -> np.ndarray:
+        rows = self.address + self.stride * np.arange(self.count)
+        return rows[:, None] + np.arange(self.width)[None, :]
+
+    def __repr__(self) -> str:
+        return (
+            f"RamField({self.name!r}, 0x{self.address:04X}, {self.encoding!r}, "
+            f"count={self.count}, stride={self.stride}, width={self.width})"
+        )
+
+
+class _DecodeGroup:
+    # All fields with the same encoding and width, decoded with one gather
+    def __init__(self, encoding: str, width: int, fields: list[RamField]) -> None:
+        self.encoding = encoding
+        self.width = width
+        self.indices = np.concatenate([field.addresses() for field in fields])
+
+        self.slices = []
+        offset = 0
+        for field in fields:
+            if encoding == "u8":
+                size = field.count * width
+            elif encoding == "bits":
+                size = field.count * width * 8
+            else:
+                size = field.count
+            self.slices.append((field.name, slice(offset, offset + size), field.scalar))
+            offset += size
+
+        # Weights for combining bytes, most significant byte first
+        if encoding in ("u16", "u24"):
+            self.weights = 256 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+        elif encoding == "bcd":
+            self.weights = 100 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+
+    def decode(self, memory: np.ndarray, results: dict) -> None:
+        rows = memory[self.indices]
+
+        if self.encoding == "u8":
+            values = rows.reshape(-1)
+        elif self.encoding == "bits":
+            values = unpack_flags(rows, axis=1).reshape(-1)
+        elif self.encoding == "popcount":
+            values = POPCOUNT[rows].sum(axis=1, dtype=np.int64)
+        elif self.encoding == "bcd":
+            rows = rows.astype(np.int64)
+            values = ((rows >> 4) * 10 + (rows & 0x0F)) @ self.weights
+        else:
+            values = rows.astype(np.int64) @ self.weights
+
+        for name, values_slice, scalar in self.slices:
+            results[name] = (
+                int(values[values_slice.start]) if scalar else values[values_slice]
+            )
+
+
+class RamSchema:
+    def __init__(self, fields: list[RamField]) -> None:
+        names = [field.name for field in fields]
+        if len(names) != len(set(names)):
+            raise ValueError(f"Duplicate RAM field names in schema: {names}")
+
+        self.fields = {field.name: field for field in fields}
+
+        grouped: dict[tuple[str, int], list[RamField]] = {}
+        for field in fields:
+            grouped.setdefault((field.encoding, field.width), []).append(field)
+
+        self.groups = [
+            _DecodeGroup(encoding, width, group_fields)
+            for (encoding, width), group_fields in grouped.items()
+        ]
+
+    def extend(self, fields: list[RamField]) -> "RamSchema":
+        return RamSchema(list(self.fields.values()) + fields)
+
+    def decode(self, memory: np.ndarray) -> dict:
+        """
+        Decodes every field from a full 64KiB memory snapshot indexed by address.
+
+        Arrays returned for multi-value fields are views into freshly gathered data and are safe to keep.
+        """
+        results = {}
+        for group in self.groups:
+            group.decode(memory, results)
+        return results
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.fields
+
+    def __len__(self) -> int:
+        return len(self.fields)
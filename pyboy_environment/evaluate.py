@@ -5,8 +5,11 @@ Do NOT edit this file as it runs the evaluation methodology for the Trained Poke
 import argparse
 import json
 import logging
+import os
 from pathlib import Path
 
+import numpy as np
+
 import cares_reinforcement_learning.util.configurations as configurations
 from cares_reinforcement_learning.util.network_factory import NetworkFactory
 from pyboy_environment.environments.pokemon.tasks.brock import PokemonBrock
@@ -25,6 +28,14 @@ def get_args():
 
     parse_args.add_argument("-r", "--results_path", type=str, required=True)
 
+    # Parallel mode - independent runs spread over worker processes,
+    # each starting after a different random number of idle frames
+    parse_args.add_argument("--num_runs", type=int, default=1)
+    parse_args.add_argument("--num_workers", type=int, default=None)
+    parse_args.add_argument("--seed", type=int, default=0)
+    parse_args.add_argument("--noop_max", type=int, default=30)
+    parse_args.add_argument("--batched", action="store_true")
+
     return parse_args.parse_args()
 
 
@@ -50,7 +61,102 @@ def run_agent(env, agent, num_episodes, results_path):
         json.dump(final_stats, file)
 
 
-def run(results_path, model_file_path, model_file_name):
+def select_actions(agent, states, action_num, batched):
+    # One batched policy call when the agent handles a batch of states,
+    # one call per state otherwise
+    if batched:
+        actions = np.asarray(agent.select_action_from_policy(states, evaluation=True))
+        if actions.size == len(states) * action_num:
+            return actions.reshape(len(states), action_num), True
+        logging.warning(
+            "Agent does not support batched states, selecting actions one at a time"
+        )
+
+    actions = [
+        agent.select_action_from_policy(state, evaluation=True) for state in states
+    ]
+    return np.asarray(actions).reshape(len(states), action_num), False
+
+
+def run_agent_parallel(
+    agent, num_steps, results_path, num_runs, num_workers, seed, noop_max, batched
+):
+    from pyboy_environment.vec_environment import VecPyboyEnvironment
+
+    # The policy and emulator are deterministic,
+    # runs with the same offset would be identical
+    rng = np.random.default_rng(seed)
+    noops = rng.choice(noop_max + 1, size=num_runs, replace=False)
+
+    run_stats = []
+    for first in range(0, num_runs, num_workers):
+        wave = range(first, min(first + num_workers, num_runs))
+        logging.info(f"Evaluating runs {wave.start} - {wave.stop - 1}")
+
+        # Runs only restart when done, as in run_agent
+        with VecPyboyEnvironment(
+            "pokemon", "brock", 24, len(wave), reset_on_truncated=False
+        ) as venv:
+            states = venv.reset()
+            for index, run_index in enumerate(wave):
+                venv.call_at(index, "_tick_emulator", int(noops[run_index]))
+                states[index] = venv.call_at(index, "_get_state")
+
+            for step in range(0, num_steps):
+                if step % 100 == 0:
+                    logging.info(f"Step: {step}")
+                actions, batched = select_actions(
+                    agent, states, venv.action_num, batched
+                )
+                states, _, _, _ = venv.step(actions)
+
+            for index, final_stats in enumerate(venv.call("_generate_game_stats")):
+                final_stats["actions"] = step
+                final_stats["noop_frames"] = int(noops[wave[index]])
+                run_stats.append(final_stats)
+
+    for run_index, final_stats in enumerate(run_stats):
+        run_path = f"{results_path}/run_{run_index}"
+        os.makedirs(run_path, exist_ok=True)
+        with open(f"{run_path}/results.json", "w", encoding="utf-8") as file:
+            json.dump(final_stats, file)
+
+    aggregate = aggregate_results(run_stats)
+    logging.info(f"Aggregate Stats: {aggregate}")
+    with open(f"{results_path}/aggregate.json", "w", encoding="utf-8") as file:
+        json.dump(aggregate, file, indent=4)
+
+    # The first run keeps the single run output for the existing tooling
+    with open(f"{results_path}/results.json", "w", encoding="utf-8") as file:
+        json.dump(run_stats[0], file)
+
+
+def aggregate_results(run_stats):
+    metrics = {
+        "badges": lambda stats: stats["badges"],
+        "money": lambda stats: stats["money"],
+        "caught_pokemon": lambda stats: stats["caught_pokemon"],
+        "seen_pokemon": lambda stats: stats["seen_pokemon"],
+        "party_size": lambda stats: stats["party_size"],
+        "levels": lambda stats: sum(stats["levels"]),
+        "xp": lambda stats: sum(stats["xp"]),
+        "events": lambda stats: sum(stats["events"]),
+    }
+
+    aggregate = {"num_runs": len(run_stats)}
+    for name, metric in metrics.items():
+        values = np.array([metric(stats) for stats in run_stats], dtype=np.float64)
+        aggregate[name] = {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "median": float(np.median(values)),
+            "min": float(values.min()),
+            "max": float(values.max()),
+        }
+    return aggregate
+
+
+def load_agent(model_file_path, model_file_name, observation_space, action_num):
     algorithm = model_file_name.split("-")[0]
 
     class_ = getattr(configurations, f"{algorithm}Config")
@@ -58,21 +164,77 @@ def run(results_path, model_file_path, model_file_name):
 
     network_factory = NetworkFactory()
 
-    brock_task = PokemonBrock(act_freq=24, headless=True)
-
     agent = network_factory.create_network(
-        brock_task.observation_space, brock_task.action_num, algorithm_config
+        observation_space, action_num, algorithm_config
     )
 
     agent.load_models(model_file_path, model_file_name)
+    return agent
+
+
+def run(results_path, model_file_path, model_file_name):
+    brock_task = PokemonBrock(act_freq=24, headless=True)
+
+    agent = load_agent(
+        model_file_path,
+        model_file_name,
+        brock_task.observation_space,
+        brock_task.action_num,
+    )
 
     run_agent(brock_task, agent, 10000, results_path)
 
 
+def run_parallel(
+    results_path,
+    model_file_path,
+    model_file_name,
+    num_runs,
+    num_workers,
+    seed,
+    noop_max,
+    batched,
+):
+    if num_runs > noop_max + 1:
+        raise ValueError(
+            f"--num_runs {num_runs} needs as many distinct no-op offsets, "
+            f"raise --noop_max to at least {num_runs - 1}"
+        )
+
+    # Only the spaces are needed here, the emulators run in the workers
+    brock_task = PokemonBrock(act_freq=24, headless=True)
+
+    agent = load_agent(
+        model_file_path,
+        model_file_name,
+        brock_task.observation_space,
+        brock_task.action_num,
+    )
+
+    if num_workers is None:
+        num_workers = min(num_runs, os.cpu_count() or 1)
+
+    run_agent_parallel(
+        agent, 10000, results_path, num_runs, num_workers, seed, noop_max, batched
+    )
+
+
 def main():
     args = get_args()
 
-    run(args.results_path, args.model_path, args.model_name)
+    if args.num_runs > 1:
+        run_parallel(
+            args.results_path,
+            args.model_path,
+            args.model_name,
+            args.num_runs,
+            args.num_workers,
+            args.seed,
+            args.noop_max,
+            args.batched,
+        )
+    else:
+        run(args.results_path, args.model_path, args.model_name)
 
 
 if __name__ == "__main__":
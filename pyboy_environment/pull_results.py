@@ -1,59 +1,37 @@
 """
 Do NOT edit this file as it runs the evaluation methodology for the Trained Pokemon agents.
+
+Pulls every submission (from Google Drive, or from a local directory laid out the same way) and evaluates them
+concurrently. Each submission gets its own workspace copy of pyboy_environment with its brock.py, so jobs do not
+overwrite each other. Virtual environments are cached by a hash of the requirements they were built from and share
+one pip cache, so identical requirements are only installed once.
+
+Local directory layout - one folder per UPI:
+    <local_path>/<upi>/requirements.txt
+    <local_path>/<upi>/brock.py
+    <local_path>/<upi>/<model folder>/<model files>
+
+Usage:
+    python pull_results.py --source local --local_path ~/submissions --cpu_budget 8 --timeout 7200
 """
 
+import argparse
+import hashlib
+import json
 import logging
 import os
+import shutil
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import virtualenv
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
-
 logging.basicConfig(level=logging.INFO)
 
-
-def run_venv(upi, requirement_path, model_path, model_name):
-    path = f"{os.path.expanduser('~')}/venv"
-    venv_dir = os.path.join(path, f"{upi}")
-    virtualenv.cli_run([venv_dir])
-
-    python_bin = f"{path}/{upi}/bin/python3"
-
-    cares_rl_path = f"{Path.home()}/workspace/cares_reinforcement_learning"
-
-    command = (
-        f". {venv_dir}/bin/activate && pip install -r {cares_rl_path}/requirements.txt"
-    )
-    os.system(command)
-
-    command = f". {venv_dir}/bin/activate && pip install {cares_rl_path}"
-    os.system(command)
-
-    command = f". {venv_dir}/bin/activate && pip install -r {requirement_path}/requirements.txt"
-    os.system(command)
-
-    command = f". {venv_dir}/bin/activate && pip install {requirement_path}"
-    os.system(command)
-
-    p = subprocess.Popen(
-        [
-            python_bin,
-            "evaluate.py",
-            "--upi",
-            upi,
-            "--model_path",
-            model_path,
-            "--model_name",
-            model_name,
-            "--results_path",
-            model_path,
-        ]
-    )
-
-    exit_code = p.wait()
-    print(f"Exit code: {exit_code} {upi}")
+PACKAGE_PATH = Path(__file__).parent
+REPOSITORY_PATH = PACKAGE_PATH.parent
 
 
 def read_folder(drive, title, file_id):
@@ -93,65 +71,326 @@ def print_folders(directory, tab=0):
         print_folders(folder, tab=tab + 5)
 
 
-def main():
-    gauth = GoogleAuth()
-    gauth.LocalWebserverAuth()
-
-    drive = GoogleDrive(gauth)
-
+class DriveSource:
     # COMPSYS726 - Assignment 1 Folder
     primary_folder_id = "1OWORBjdzuJjPZYZoCKMs4hI3xemvcDzh"
 
-    directory = read_folder(
-        drive, "COMPSYS726 - Assignments", file_id=primary_folder_id
-    )
+    def __init__(self):
+        from pydrive2.auth import GoogleAuth
+        from pydrive2.drive import GoogleDrive
 
-    print_folders(directory)
+        gauth = GoogleAuth()
+        gauth.LocalWebserverAuth()
 
-    for folders in directory["folders"]:
-        upi = folders["title"]
-        print(f"Title: {upi}")
+        self.drive = GoogleDrive(gauth)
+
+        self.directory = read_folder(
+            self.drive, "COMPSYS726 - Assignments", file_id=self.primary_folder_id
+        )
+        print_folders(self.directory)
+
+        self.folders = {folder["title"]: folder for folder in self.directory["folders"]}
 
+    def submissions(self):
+        return list(self.folders)
+
+    def fetch(self, upi, results_path):
+        # Downloads the submission into results_path and returns the model name
+        folders = self.folders[upi]
         files = folders["files"]
-        requirements_id = files["requirements.txt"]["id"]
-        brock_task_id = files["brock.py"]["id"]
 
+        file = self.drive.CreateFile({"id": files["requirements.txt"]["id"]})
+        file.GetContentFile(f"{results_path}/requirements.txt")
+
+        file = self.drive.CreateFile({"id": files["brock.py"]["id"]})
+        file.GetContentFile(f"{results_path}/brock.py")
+
+        if not folders["folders"]:
+            raise FileNotFoundError(f"No model folder in the submission of {upi}")
         model_folder = folders["folders"][0]
         logging.info(f"{model_folder=}")
 
-        requirement_path = f"{Path(__file__).parent.parent}"
-        logging.info(f"{requirement_path=}")
+        model_path = f"{results_path}/models"
+        os.makedirs(model_path, exist_ok=True)
 
-        brock_path = f"{Path(__file__).parent.parent}/pyboy_environment/environments/pokemon/tasks"
-        logging.info(f"{brock_path=}")
+        model_name = None
+        for file_name, model_info in model_folder["files"].items():
+            model_name = file_name.split("_")[0]
+            file = self.drive.CreateFile({"id": model_info["id"]})
+            file.GetContentFile(f"{model_path}/{file_name}")
 
-        results_path = f"{Path(__file__).parent.parent}/results/{upi}"
-        logging.info(f"Saving data into: {results_path}")
+        if model_name is None:
+            raise FileNotFoundError(f"No model files in {model_folder['title']}")
+        return model_name
+
+
+class LocalSource:
+    # Stand-in for Drive that reads submissions from a local directory with the same layout
+    def __init__(self, local_path):
+        self.local_path = Path(local_path).expanduser()
+
+    def submissions(self):
+        return sorted(path.name for path in self.local_path.iterdir() if path.is_dir())
+
+    def fetch(self, upi, results_path):
+        submission_path = self.local_path / upi
+
+        shutil.copy(submission_path / "requirements.txt", results_path)
+        shutil.copy(submission_path / "brock.py", results_path)
+
+        model_folders = sorted(
+            path for path in submission_path.iterdir() if path.is_dir()
+        )
+        if not model_folders:
+            raise FileNotFoundError(f"No model folder in {submission_path}")
+        model_folder = model_folders[0]
+
+        model_path = f"{results_path}/models"
+        os.makedirs(model_path, exist_ok=True)
+
+        model_name = None
+        for file in sorted(model_folder.iterdir()):
+            model_name = file.name.split("_")[0]
+            shutil.copy(file, model_path)
+
+        if model_name is None:
+            raise FileNotFoundError(f"No model files in {model_folder}")
+        return model_name
+
+
+class VenvCache:
+    """
+    Virtual environments keyed by a hash of the requirements installed into them. A venv is built once under
+    `<venv_root>/<hash>` and reused by every submission with the same requirements.
+    """
+
+    def __init__(self, venv_root, pip_cache_dir, cares_rl_path):
+        self.venv_root = Path(venv_root).expanduser()
+        self.pip_cache_dir = Path(pip_cache_dir).expanduser()
+        self.cares_rl_path = Path(cares_rl_path)
+
+        self.venv_root.mkdir(parents=True, exist_ok=True)
+        self.pip_cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def key(self, requirements_file):
+        digest = hashlib.sha256()
+        digest.update(sys.version.encode("utf-8"))
+        for path in (self.cares_rl_path / "requirements.txt", Path(requirements_file)):
+            if path.exists():
+                digest.update(path.read_bytes())
+        return digest.hexdigest()[:16]
+
+    def get(self, requirements_file, log_file, timeout=None):
+        key = self.key(requirements_file)
+        venv_dir = self.venv_root / key
+        python_bin = venv_dir / "bin" / "python3"
+
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        # Jobs with the same requirements wait for the first one to build the venv
+        with lock:
+            if (venv_dir / ".complete").exists():
+                logging.info(f"Reusing venv {venv_dir}")
+                return python_bin
+
+            import virtualenv
+
+            logging.info(f"Building venv {venv_dir}")
+            shutil.rmtree(venv_dir, ignore_errors=True)
+            virtualenv.cli_run([str(venv_dir)])
+
+            installs = [
+                ["-r", str(self.cares_rl_path / "requirements.txt")],
+                [str(self.cares_rl_path)],
+                ["-r", str(requirements_file)],
+            ]
+            for install in installs:
+                command = [str(python_bin), "-m", "pip", "install"]
+                command += ["--cache-dir", str(self.pip_cache_dir)] + install
+                # A timed out build is not marked complete, so the next job rebuilds it
+                subprocess.run(
+                    command,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    check=True,
+                    timeout=timeout,
+                )
+
+            (venv_dir / ".complete").touch()
+        return python_bin
+
+
+def prepare_workspace(results_path):
+    # Copy of this package with the submission's brock.py, imported instead of an installed pyboy_environment
+    workspace = Path(results_path) / "workspace"
+    shutil.rmtree(workspace, ignore_errors=True)
+    shutil.copytree(
+        PACKAGE_PATH,
+        workspace / "pyboy_environment",
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    shutil.copy(
+        Path(results_path) / "brock.py",
+        workspace / "pyboy_environment/environments/pokemon/tasks/brock.py",
+    )
+    return workspace
+
+
+def evaluate_submission(
+    upi, results_path, model_name, venv_cache, cpus_per_job, timeout
+):
+    start_time = time.time()
+    summary = {"upi": upi, "model_name": model_name}
+
+    with open(f"{results_path}/evaluate.log", "w", encoding="utf-8") as log_file:
+        try:
+            python_bin = venv_cache.get(
+                f"{results_path}/requirements.txt", log_file, timeout
+            )
+            workspace = prepare_workspace(results_path)
+
+            # Keep numerical libraries within the job's share of the CPU budget
+            env = dict(os.environ)
+            env["PYTHONPATH"] = str(workspace)
+            for variable in (
+                "OMP_NUM_THREADS",
+                "MKL_NUM_THREADS",
+                "OPENBLAS_NUM_THREADS",
+            ):
+                env[variable] = str(cpus_per_job)
+
+            log_file.flush()
+            process = subprocess.run(
+                [
+                    str(python_bin),
+                    "-m",
+                    "pyboy_environment.evaluate",
+                    "--upi",
+                    upi,
+                    "--model_path",
+                    results_path,
+                    "--model_name",
+                    model_name,
+                    "--results_path",
+                    results_path,
+                ],
+                cwd=workspace,
+                env=env,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                timeout=timeout,
+            )
+            summary["exit_code"] = process.returncode
+            summary["status"] = "ok" if process.returncode == 0 else "failed"
+        except subprocess.TimeoutExpired:
+            summary["status"] = "timeout"
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error(f"{upi} failed: {error}")
+            summary["status"] = "error"
+            summary["error"] = str(error)
+
+    summary["duration"] = time.time() - start_time
+    logging.info(f"Finished {upi}: {summary['status']} in {summary['duration']:.0f}s")
+    return summary
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument(
+        "--source", type=str, default="drive", choices=["drive", "local"]
+    )
+    parse_args.add_argument("--local_path", type=str, default=None)
+    parse_args.add_argument("--upis", type=str, nargs="+", default=None)
+
+    parse_args.add_argument(
+        "--results_root", type=str, default=f"{REPOSITORY_PATH}/results"
+    )
+    parse_args.add_argument("--venv_root", type=str, default="~/venv")
+    parse_args.add_argument("--pip_cache_dir", type=str, default="~/venv/pip_cache")
+    parse_args.add_argument(
+        "--cares_rl_path",
+        type=str,
+        default=f"{Path.home()}/workspace/cares_reinforcement_learning",
+    )
 
-        if not os.path.exists(results_path):
-            os.makedirs(results_path)
+    parse_args.add_argument("--cpu_budget", type=int, default=os.cpu_count())
+    parse_args.add_argument("--cpus_per_job", type=int, default=1)
+    # Seconds per submission evaluation
+    parse_args.add_argument("--timeout", type=float, default=4 * 60 * 60)
 
-        file = drive.CreateFile({"id": requirements_id})
-        file.GetContentFile(f"{requirement_path}/requirements.txt")
+    return parse_args.parse_args()
 
-        file = drive.CreateFile({"id": brock_task_id})
-        file.GetContentFile(f"{brock_path}/brock.py")
 
-        logging.info(f"{type(model_folder['files'])=}")
+def main():
+    args = get_args()
 
-        for file_name, model_info in model_folder["files"].items():
-            model_name = file_name.split("_")[0]
-            logging.info(f"{file_name=}")
-            logging.info(f"{model_info=}")
-            logging.info(f"{model_name=}")
-            file = drive.CreateFile({"id": model_info["id"]})
-
-            model_path = f"{results_path}/models"
-            if not os.path.exists(model_path):
-                os.makedirs(model_path)
-            file.GetContentFile(f"{model_path}/{file_name}")
+    if args.source == "local":
+        if args.local_path is None:
+            raise ValueError("--local_path is required for the local source")
+        source = LocalSource(args.local_path)
+    else:
+        source = DriveSource()
 
-        run_venv(upi, requirement_path, results_path, model_name)
+    venv_cache = VenvCache(args.venv_root, args.pip_cache_dir, args.cares_rl_path)
+
+    upis = args.upis if args.upis is not None else source.submissions()
+
+    # Downloads happen one at a time, evaluation runs concurrently within the CPU budget
+    jobs = []
+    summaries = {}
+    for upi in upis:
+        print(f"Title: {upi}")
+        results_path = f"{args.results_root}/{upi}"
+        logging.info(f"Saving data into: {results_path}")
+        os.makedirs(results_path, exist_ok=True)
+
+        # A broken submission is reported in the summary instead of stopping the batch
+        try:
+            model_name = source.fetch(upi, results_path)
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error(f"{upi} could not be fetched: {error}")
+            summaries[upi] = {
+                "upi": upi,
+                "model_name": None,
+                "status": "error",
+                "error": str(error),
+                "duration": 0.0,
+            }
+            continue
+        jobs.append((upi, results_path, model_name))
+
+    max_jobs = max(1, args.cpu_budget // args.cpus_per_job)
+    logging.info(f"Evaluating {len(jobs)} submissions, {max_jobs} at a time")
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        futures = {
+            upi: executor.submit(
+                evaluate_submission,
+                upi,
+                results_path,
+                model_name,
+                venv_cache,
+                args.cpus_per_job,
+                args.timeout,
+            )
+            for upi, results_path, model_name in jobs
+        }
+        for upi, future in futures.items():
+            summaries[upi] = future.result()
+    summaries = [summaries[upi] for upi in dict.fromkeys(upis)]
+
+    with open(f"{args.results_root}/summary.json", "w", encoding="utf-8") as file:
+        json.dump(summaries, file, indent=4)
+
+    for summary in summaries:
+        print(
+            f"Exit code: {summary.get('exit_code')} {summary['upi']} ({summary['status']})"
+        )
 
 
 if __name__ == "__main__":
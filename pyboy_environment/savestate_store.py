@@ -0,0 +1,222 @@
+"""
+Content-addressed store of emulator savestates.
+
+States are keyed by a hash of their raw bytes, so storing a state that is already in the store costs one hash. Stored
+states are XOR-delta encoded against a reference state, typically the task's init state, and zlib compressed: most of
+a savestate (ROM banks, VRAM, unchanged WRAM) matches the reference, XORs to zeros and compresses away.
+
+Encoded states are kept in an in-process LRU tier bounded by `memory_bytes`. With a `path`, states evicted from memory
+are written to an on-disk tier (one file per state under `<path>/<key[:2]>/`) and read back on access; `flush` writes
+every state that is only held in memory. Without a disk tier evicted states are gone, except pinned ones: keys that
+something still refers to (e.g. a cell archive) are pinned with `put(state, pin=True)` and stay in memory until
+`unpin`ned as often.
+
+Usage:
+    store = SavestateStore("states/brock", reference=env._init_state())
+    key = store.save(env)
+    store.load(env, key)
+"""
+
+import hashlib
+import io
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+REFERENCE_FILE = "reference.state"
+
+_RAW = 0
+_DELTA = 1
+# Encoding, length of the raw state
+_HEADER = struct.Struct("<BI")
+
+
+def state_key(state: bytes) -> str:
+    return hashlib.blake2b(state, digest_size=16).hexdigest()
+
+
+def encode_state(state: bytes, reference: bytes = None, level: int = 1) -> bytes:
+    # States of a different length than the reference (another ROM or emulator version) are stored without delta
+    if reference is not None and len(reference) == len(state):
+        delta = np.frombuffer(state, dtype=np.uint8) ^ np.frombuffer(
+            reference, dtype=np.uint8
+        )
+        return _HEADER.pack(_DELTA, len(state)) + zlib.compress(delta.tobytes(), level)
+    return _HEADER.pack(_RAW, len(state)) + zlib.compress(state, level)
+
+
+def decode_state(blob: bytes, reference: bytes = None) -> bytes:
+    encoding, size = _HEADER.unpack_from(blob)
+    data = zlib.decompress(blob[_HEADER.size :])
+    if len(data) != size:
+        raise ValueError(f"Corrupt savestate: {len(data)} bytes, expected {size}")
+
+    if encoding == _DELTA:
+        if reference is None or len(reference) != size:
+            raise ValueError("Delta encoded savestate needs its reference state")
+        state = np.frombuffer(data, dtype=np.uint8) ^ np.frombuffer(
+            reference, dtype=np.uint8
+        )
+        return state.tobytes()
+    return data
+
+
+class SavestateStore:
+    def __init__(
+        self,
+        path: str = None,
+        reference: bytes = None,
+        memory_bytes: int = 256 * 1024 * 1024,
+        level: int = 1,
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.reference = reference
+        self.memory_bytes = memory_bytes
+        self.level = level
+
+        # Key -> encoded state, least recently used first
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_used = 0
+        self.disk_keys: set[str] = set()
+        # Key -> pin count
+        self.pins: dict[str, int] = {}
+
+        # Raw and encoded bytes of the unique states stored, and counters
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self.puts = 0
+        self.duplicates = 0
+        self.memory_hits = 0
+        self.disk_reads = 0
+
+        if self.path is not None:
+            self._open_disk_tier()
+
+    def put(self, state: bytes, pin: bool = False) -> str:
+        self.puts += 1
+        key = state_key(state)
+        # Pinned before storing, so the new state can not be evicted straight away
+        if pin:
+            self.pin(key)
+        if key in self.memory or key in self.disk_keys:
+            self.duplicates += 1
+            return key
+
+        blob = encode_state(state, self.reference, self.level)
+        self.raw_bytes += len(state)
+        self.encoded_bytes += len(blob)
+        self._remember(key, blob)
+        return key
+
+    def get(self, key: str) -> bytes:
+        blob = self.memory.get(key)
+        if blob is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+        elif key in self.disk_keys:
+            with open(self._file(key), "rb") as file:
+                blob = file.read()
+            self.disk_reads += 1
+            self._remember(key, blob)
+        else:
+            raise KeyError(key)
+        return decode_state(blob, self.reference)
+
+    def pin(self, key: str) -> None:
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key: str) -> None:
+        count = self.pins.get(key, 0) - 1
+        if count > 0:
+            self.pins[key] = count
+        else:
+            self.pins.pop(key, None)
+
+    def encoded_size(self, key: str) -> int:
+        blob = self.memory.get(key)
+        if blob is not None:
+            return len(blob)
+        if key in self.disk_keys:
+            return os.path.getsize(self._file(key))
+        raise KeyError(key)
+
+    def save(self, env) -> str:
+        return self.put(env._save_state())
+
+    def load(self, env, key: str) -> None:
+        env._load_state(io.BytesIO(self.get(key)))
+
+    def flush(self) -> None:
+        # Writes every state only held in memory to the disk tier
+        if self.path is None:
+            return
+        for key, blob in self.memory.items():
+            if key not in self.disk_keys:
+                self._write(key, blob)
+
+    def compression_ratio(self) -> float:
+        if self.encoded_bytes == 0:
+            return 0.0
+        return self.raw_bytes / self.encoded_bytes
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        self.memory[key] = blob
+        self.memory_used += len(blob)
+
+        if self.memory_used <= self.memory_bytes:
+            return
+
+        # Least recently used first, never the state just stored
+        for old_key in list(self.memory)[:-1]:
+            if self.memory_used <= self.memory_bytes:
+                break
+            # Without a disk tier a pinned state's only copy is in memory
+            if self.path is None and old_key in self.pins:
+                continue
+
+            old_blob = self.memory.pop(old_key)
+            self.memory_used -= len(old_blob)
+            if self.path is not None and old_key not in self.disk_keys:
+                self._write(old_key, old_blob)
+
+    def _file(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.state"
+
+    def _write(self, key: str, blob: bytes) -> None:
+        file_path = self._file(key)
+        file_path.parent.mkdir(exist_ok=True)
+
+        # Written to a temporary file first so a crash never leaves a partial state under its key
+        temp_path = file_path.with_suffix(".tmp")
+        with open(temp_path, "wb") as file:
+            file.write(blob)
+        os.replace(temp_path, file_path)
+        self.disk_keys.add(key)
+
+    def _open_disk_tier(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Delta encoded states on disk can only be decoded against the reference they were written with
+        reference_path = self.path / REFERENCE_FILE
+        if reference_path.exists():
+            stored = reference_path.read_bytes()
+            if self.reference is None:
+                self.reference = stored
+            elif stored != self.reference:
+                raise ValueError(
+                    f"{self.path} was written against a different reference state"
+                )
+        elif self.reference is not None:
+            reference_path.write_bytes(self.reference)
+
+        self.disk_keys = {file.stem for file in self.path.glob("*/*.state")}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.memory or key in self.disk_keys
+
+    def __len__(self) -> int:
+        return len(self.disk_keys.union(self.memory))
@@ -1,6 +1,72 @@
+import time
+
 from pyboy_environment.environments import PyboyEnvironment
-from pyboy_environment.environments.mario.mario_run import MarioRun
-from pyboy_environment.environments.pokemon.tasks.brock import PokemonBrock
+
+
+class EnvironmentPool:
+    """
+    Keeps booted emulators of released environments for reuse by `make(..., pooled=True)`.
+
+    Emulators are keyed by domain, headless and backend - the ROM and window they were started with. A pooled
+    environment is a new environment object (so none of the previous run's state carries over) that is handed an idle
+    emulator, which only has to load the task's init state on first use. At most `max_size` idle emulators are kept
+    and ones idle for longer than `idle_timeout` seconds are stopped.
+    """
+
+    def __init__(self, max_size: int = 8, idle_timeout: float = 300.0) -> None:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # Key -> list of (release time, emulator), most recently released last
+        self.idle = {}
+
+    def acquire(self, key: tuple):
+        self.evict()
+        emulators = self.idle.get(key)
+        if not emulators:
+            return None
+        _, emulator = emulators.pop()
+        return emulator
+
+    def release(self, key: tuple, emulator) -> None:
+        self.idle.setdefault(key, []).append((time.monotonic(), emulator))
+        self.evict()
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        # Sorted on the release time only, emulators do not compare
+        entries = sorted(
+            (
+                (released, key, emulator)
+                for key, emulators in self.idle.items()
+                for released, emulator in emulators
+            ),
+            key=lambda entry: entry[0],
+        )
+        # Oldest first, drop anything idle for too long and anything over the size limit
+        excess = len(entries) - self.max_size
+        for index, (released, key, emulator) in enumerate(entries):
+            if index < excess or now - released > self.idle_timeout:
+                self.idle[key].remove((released, emulator))
+                emulator.stop(save=False)
+
+    def clear(self) -> None:
+        for emulators in self.idle.values():
+            for _, emulator in emulators:
+                emulator.stop(save=False)
+        self.idle.clear()
+
+    def __len__(self) -> int:
+        return sum(len(emulators) for emulators in self.idle.values())
+
+
+pool = EnvironmentPool()
+
+
+def configure_pool(max_size: int = 8, idle_timeout: float = 300.0) -> None:
+    pool.max_size = max_size
+    pool.idle_timeout = idle_timeout
+    pool.evict()
 
 
 def make(
@@ -9,18 +75,67 @@ def make(
     act_freq: int,
     emulation_speed: int = 0,
     headless: bool = False,
+    backend: str = "pyboy",
+    pooled: bool = False,
 ) -> PyboyEnvironment:
 
+    pool_key = (domain, headless, backend)
+    emulator = pool.acquire(pool_key) if pooled else None
+    if emulator is not None:
+        backend = emulator
+
+    try:
+        env = _construct(domain, task, act_freq, emulation_speed, headless)
+    except Exception:
+        # The emulator is still idle, hand it back instead of leaking it
+        if emulator is not None:
+            pool.release(pool_key, emulator)
+        raise
+
+    # Submitted brock.py files only take (act_freq, emulation_speed, headless), the backend is attached before the
+    # emulator boots on first use
+    env.backend = backend
+
+    if pooled:
+        env.pool_key = pool_key
+    return env
+
+
+def _construct(
+    domain: str, task: str, act_freq: int, emulation_speed: int, headless: bool
+) -> PyboyEnvironment:
     if domain == "mario":
         if task == "run":
+            from pyboy_environment.environments.mario.mario_run import MarioRun
+
             env = MarioRun(act_freq, emulation_speed, headless)
         else:
             raise ValueError(f"Unknown Mario task: {task}")
     elif domain == "pokemon":
         if task == "brock":
+            from pyboy_environment.environments.pokemon.tasks.brock import (
+                PokemonBrock,
+            )
+
             env = PokemonBrock(act_freq, emulation_speed, headless)
         else:
             raise ValueError(f"Unknown Pokemon task: {task}")
     else:
         raise ValueError(f"Unknown pyboy environment: {task}")
     return env
+
+
+def release(env: PyboyEnvironment) -> None:
+    """
+    Returns the emulator of an environment made with `pooled=True` to the pool, other environments' emulators are
+    stopped. The environment can not be used afterwards.
+    """
+    emulator = env.release_emulator()
+    if emulator is None:
+        return
+
+    key = getattr(env, "pool_key", None)
+    if key is None:
+        emulator.stop(save=False)
+    else:
+        pool.release(key, emulator)
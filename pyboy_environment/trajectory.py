@@ -0,0 +1,290 @@
+"""
+Deterministic recording and replay of environment trajectories.
+
+A trajectory file starts with a small header (magic, version and a JSON description of the environment - domain, task,
+act_freq, init state file and a hash of its contents, and how frames were ticked and rendered) followed by a stream of
+records:
+
+    R                                      - reset to the init state
+    A <action_num float64>                 - one step with this action
+    C <step u64> <crc32 u32> <size u32>    - savestate taken after `step` steps, crc32 of the raw state
+
+Checkpoints are XOR-delta encoded against the init state and zlib compressed (see savestate_store.encode_state),
+version 1 files with plain zlib checkpoints are still read.
+
+Replaying only re-runs `_run_action_on_emulator` headless, so it is much faster than the original run. Savestates
+include the screen buffer, so frames are ticked and rendered the way they were while recording - a headless run without
+image observations replays with rendering off. Seeking restores the nearest checkpoint (or reset) at or before the
+target step and fast-forwards from there.
+
+Usage:
+    with TrajectoryRecorder(env, "run.traj", checkpoint_interval=1000) as recorder:
+        state = recorder.reset()
+        state, reward, done, truncated = recorder.step(action)
+        state, reward, dones, truncateds = recorder.step_many(actions)
+
+    replayer = TrajectoryReplayer("run.traj")
+    replayer.seek(5000)
+    mismatches = replayer.verify()
+"""
+
+import hashlib
+import io
+import json
+import logging
+import struct
+import zlib
+
+import numpy as np
+
+from pyboy_environment import suite
+from pyboy_environment.savestate_store import decode_state, encode_state
+
+MAGIC = b"PYBOYTRJ"
+VERSION = 2
+
+_RESET = b"R"
+_ACTION = b"A"
+_CHECKPOINT = b"C"
+
+_CHECKPOINT_HEADER = struct.Struct("<QII")
+
+
+class TrajectoryRecorder:
+    """
+    Wraps an environment and records every reset and step. Recording starts at the first `reset`.
+    """
+
+    def __init__(self, env, path: str, checkpoint_interval: int = 1000) -> None:
+        self.env = env
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+
+        self.step_count = 0
+        self.started = False
+        self.init_state = env._init_state()
+
+        self.file = open(path, "wb")
+        metadata = {
+            "domain": env.domain,
+            "task": env.task,
+            "act_freq": env.act_freq,
+            "action_num": env.action_num,
+            "init_state_file_name": env.init_state_file_name,
+            "init_state_id": hashlib.sha1(self.init_state).hexdigest(),
+            "checkpoint_interval": checkpoint_interval,
+            # Both change the screen buffer in the checkpoints, so they can not change while recording
+            "batch_ticks": env.batch_ticks,
+            "render_frames": env.render_frames,
+        }
+        self.render_settings = (env.batch_ticks, env.render_frames)
+        header = json.dumps(metadata).encode("utf-8")
+        self.file.write(MAGIC)
+        self.file.write(struct.pack("<HI", VERSION, len(header)))
+        self.file.write(header)
+
+    def reset(self) -> np.ndarray:
+        state = self.env.reset()
+        self.file.write(_RESET)
+        self.started = True
+        return state
+
+    def step(self, action) -> tuple:
+        self._check_recording()
+        result = self.env.step(action)
+        self._record(action)
+        return result
+
+    def step_many(self, actions) -> tuple:
+        self._check_recording()
+        return self.env.step_many(actions, step_callback=self._record)
+
+    def _check_recording(self) -> None:
+        if not self.started:
+            raise RuntimeError("Call reset before recording steps")
+        if (self.env.batch_ticks, self.env.render_frames) != self.render_settings:
+            raise RuntimeError(
+                "Frame rendering changed while recording, the checkpoints would not replay"
+            )
+
+    def _record(self, action) -> None:
+        # Called straight after the step of the action, before anything else runs on the emulator
+        action = np.asarray(action, dtype=np.float64).reshape(self.env.action_num)
+
+        self.file.write(_ACTION)
+        self.file.write(action.tobytes())
+        self.step_count += 1
+
+        if self.step_count % self.checkpoint_interval == 0:
+            state = self.env._save_state()
+            compressed = encode_state(state, self.init_state)
+            self.file.write(_CHECKPOINT)
+            self.file.write(
+                _CHECKPOINT_HEADER.pack(
+                    self.step_count, zlib.crc32(state), len(compressed)
+                )
+            )
+            self.file.write(compressed)
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+    def __getattr__(self, name):
+        # Everything else is forwarded to the wrapped environment
+        return getattr(self.env, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Trajectory:
+    # Parsed trajectory file: actions plus the steps where resets and checkpoints happened
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            data = file.read()
+
+        if not data.startswith(MAGIC):
+            raise ValueError(f"Not a trajectory file: {path}")
+        offset = len(MAGIC)
+        version, header_size = struct.unpack_from("<HI", data, offset)
+        if version not in (1, VERSION):
+            raise ValueError(f"Unsupported trajectory version: {version}")
+        offset += struct.calcsize("<HI")
+        self.version = version
+
+        self.metadata = json.loads(data[offset : offset + header_size])
+        offset += header_size
+
+        action_num = self.metadata["action_num"]
+        action_size = action_num * 8
+
+        actions = []
+        # Steps after which the environment was reset, 0 for the reset that starts the recording
+        self.resets = set()
+        # Step index -> (crc32, compressed savestate)
+        self.checkpoints = {}
+
+        while offset < len(data):
+            tag = data[offset : offset + 1]
+            offset += 1
+            if tag == _ACTION:
+                actions.append(data[offset : offset + action_size])
+                offset += action_size
+            elif tag == _RESET:
+                self.resets.add(len(actions))
+            elif tag == _CHECKPOINT:
+                step, crc, size = _CHECKPOINT_HEADER.unpack_from(data, offset)
+                offset += _CHECKPOINT_HEADER.size
+                self.checkpoints[step] = (crc, data[offset : offset + size])
+                offset += size
+            else:
+                # A truncated file (e.g. the recording process was killed) ends here
+                logging.warning(f"Unexpected trajectory record at byte {offset - 1}")
+                break
+
+        self.actions = np.frombuffer(b"".join(actions), dtype=np.float64).reshape(
+            -1, action_num
+        )
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+
+class TrajectoryReplayer:
+    def __init__(self, path: str, backend: str = "pyboy") -> None:
+        self.trajectory = Trajectory(path)
+        metadata = self.trajectory.metadata
+
+        self.env = suite.make(
+            metadata["domain"],
+            metadata["task"],
+            metadata["act_freq"],
+            headless=True,
+            backend=backend,
+        )
+        # Rendered as recorded, files without the settings were recorded with rendering off
+        self.env.batch_ticks = metadata.get("batch_ticks", True)
+        self.env.render_frames = metadata.get("render_frames", False)
+
+        self.init_state = self.env._init_state()
+        if hashlib.sha1(self.init_state).hexdigest() != metadata["init_state_id"]:
+            logging.warning(
+                f"Init state {metadata['init_state_file_name']} differs from the recorded one, replay will diverge"
+            )
+        self.current_step = None
+
+    def __len__(self) -> int:
+        return len(self.trajectory)
+
+    def seek(self, step: int) -> None:
+        """
+        Puts the emulator in the state after `step` steps of the trajectory, including a reset recorded at that step.
+        """
+        if not 0 <= step <= len(self.trajectory):
+            raise IndexError(f"Step {step} outside of trajectory [0, {len(self)}]")
+
+        point = self._restore_point(step)
+        if self.current_step is None or not point <= self.current_step <= step:
+            self._restore(point)
+
+        self._fast_forward(step)
+
+    def verify(self) -> int:
+        """
+        Replays the whole trajectory from the start, comparing the emulator state with every checkpoint. Returns the
+        number of mismatching checkpoints.
+        """
+        resets = self.trajectory.resets
+        checkpoints = self.trajectory.checkpoints
+
+        mismatches = 0
+        self._restore(0)
+        for index, action in enumerate(self.trajectory.actions):
+            self.env._run_action_on_emulator(action)
+
+            step = index + 1
+            # Checkpoints are saved straight after the step, before any reset that follows it
+            if step in checkpoints:
+                crc, _ = checkpoints[step]
+                if zlib.crc32(self.env._save_state()) != crc:
+                    logging.error(f"Replay diverged from the recording at step {step}")
+                    mismatches += 1
+            if step in resets:
+                self.env._load_state(io.BytesIO(self.init_state))
+
+        self.current_step = len(self.trajectory)
+        return mismatches
+
+    def _restore_point(self, step: int) -> int:
+        # Latest reset or checkpoint at or before step
+        points = [point for point in self.trajectory.resets if point <= step]
+        points += [point for point in self.trajectory.checkpoints if point <= step]
+        return max(points, default=0)
+
+    def _restore(self, point: int) -> None:
+        if point in self.trajectory.resets or point not in self.trajectory.checkpoints:
+            self.env._load_state(io.BytesIO(self.init_state))
+        else:
+            _, compressed = self.trajectory.checkpoints[point]
+            if self.trajectory.version == 1:
+                state = zlib.decompress(compressed)
+            else:
+                state = decode_state(compressed, self.init_state)
+            self.env._load_state(io.BytesIO(state))
+
+        if point > 0:
+            self.env._restore_pending_inputs(self.trajectory.actions[point - 1])
+        self.current_step = point
+
+    def _fast_forward(self, step: int) -> None:
+        resets = self.trajectory.resets
+        actions = self.trajectory.actions
+        for index in range(self.current_step, step):
+            self.env._run_action_on_emulator(actions[index])
+            if index + 1 in resets:
+                self.env._load_state(io.BytesIO(self.init_state))
+        self.current_step = step
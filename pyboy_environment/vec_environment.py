@@ -0,0 +1,392 @@
+"""
+Vectorised wrapper that runs several PyboyEnvironment instances in worker processes.
+
+Each worker owns a single PyBoy emulator created through `pyboy_environment.suite.make`. Actions, observations,
+rewards and done/truncated flags are exchanged through one shared memory block, the pipes only carry small command
+messages, so the per-step cost does not grow with the size of the observation.
+
+With `start_method="forkserver"` the workers are forked from a fork server that has preloaded the package and booted
+an emulator for the task, see `pyboy_environment.zygote`. `worker_stats` reports the startup time and memory of every
+worker to compare start methods.
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pyboy_environment import suite, zygote
+
+
+class _SharedBuffers:
+    # Layout of the shared memory block, identical in the parent and in every worker
+    def __init__(
+        self,
+        shm: shared_memory.SharedMemory,
+        num_envs: int,
+        observation_size: int,
+        action_num: int,
+        dtype: np.dtype,
+    ) -> None:
+        self.shm = shm
+
+        layout = [
+            ("states", (num_envs, observation_size), dtype),
+            ("final_states", (num_envs, observation_size), dtype),
+            ("actions", (num_envs, action_num), np.float64),
+            ("rewards", (num_envs,), np.float64),
+            ("dones", (num_envs,), np.bool_),
+            ("truncateds", (num_envs,), np.bool_),
+        ]
+
+        offset = 0
+        for name, shape, field_dtype in layout:
+            field_dtype = np.dtype(field_dtype)
+            # Keep every array aligned to 8 bytes
+            offset = (offset + 7) & ~7
+            array = np.ndarray(shape, dtype=field_dtype, buffer=shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+    @staticmethod
+    def size(
+        num_envs: int, observation_size: int, action_num: int, dtype: np.dtype
+    ) -> int:
+        itemsize = np.dtype(dtype).itemsize
+        sizes = [
+            num_envs * observation_size * itemsize,
+            num_envs * observation_size * itemsize,
+            num_envs * action_num * 8,
+            num_envs * 8,
+            num_envs,
+            num_envs,
+        ]
+        return sum((size + 7) & ~7 for size in sizes)
+
+
+def _worker(
+    index: int,
+    remote,
+    parent_remote,
+    domain: str,
+    task: str,
+    act_freq: int,
+    emulation_speed: int,
+    headless: bool,
+    backend: str,
+    reset_on_truncated: bool,
+    pooled: bool,
+    image_observation: dict,
+) -> None:
+    parent_remote.close()
+
+    shm = None
+    buffers = None
+    try:
+        env = suite.make(
+            domain, task, act_freq, emulation_speed, headless, backend, pooled
+        )
+        # Must be enabled before the spec is sent, it sets the row width of the shared states
+        if image_observation is not None:
+            env.enable_image_observation(**image_observation)
+
+        # An emulator inherited from the fork server is already booted
+        preloaded = not isinstance(env.backend, str)
+        # Boot now so the startup time covers it
+        env.pyboy
+        startup = {
+            "pid": os.getpid(),
+            "ready_time": time.monotonic(),
+            "preloaded": preloaded,
+        }
+        remote.send(("spec", (env.observation_space, env.action_num, startup)))
+
+        command, data = remote.recv()
+        if command == "close":
+            return
+        shm_name, num_envs, observation_size, action_num, dtype = data
+        shm = shared_memory.SharedMemory(name=shm_name)
+        buffers = _SharedBuffers(shm, num_envs, observation_size, action_num, dtype)
+        remote.send(("ready", None))
+
+        while True:
+            command, data = remote.recv()
+
+            if command == "step":
+                action = buffers.actions[index]
+                state, reward, done, truncated = env.step(action)
+
+                buffers.rewards[index] = reward
+                buffers.dones[index] = done
+                buffers.truncateds[index] = truncated
+
+                if done or (truncated and reset_on_truncated):
+                    # Auto-reset, the last observation of the episode is kept in final_states
+                    buffers.final_states[index] = np.ravel(state)
+                    state = env.reset()
+
+                # Image observations are flattened into the row
+                buffers.states[index] = np.ravel(state)
+                remote.send(("ok", None))
+            elif command == "reset":
+                buffers.states[index] = np.ravel(env.reset())
+                remote.send(("ok", None))
+            elif command == "seed":
+                env.set_seed(data)
+                remote.send(("ok", None))
+            elif command == "call":
+                name, args, kwargs = data
+                result = getattr(env, name)
+                if callable(result):
+                    result = result(*args, **kwargs)
+                remote.send(("ok", result))
+            elif command == "close":
+                break
+            else:
+                raise ValueError(f"Unknown worker command: {command}")
+    except KeyboardInterrupt:
+        pass
+    except Exception:  # pylint: disable=broad-except
+        remote.send(("error", traceback.format_exc()))
+    finally:
+        if shm is not None:
+            buffers = None
+            shm.close()
+        remote.close()
+
+
+class VecPyboyEnvironment:
+    """
+    Runs `num_envs` copies of the same suite environment, one per worker process.
+
+    `step` takes a batch of actions with shape (num_envs, action_num) and returns batched NumPy arrays
+    `(states, rewards, dones, truncateds)`. Sub-environments that finish are reset automatically, the observation
+    that ended the episode is available in `final_states`. With `reset_on_truncated=False` only done resets a
+    sub-environment.
+
+    `image_observation` takes the arguments of `enable_image_observation` (e.g. {"scale": 2, "stack": 4}). Workers
+    enable it before reporting their observation size; the states are then uint8 rows, reshape a row to
+    (stack, rows, cols) or (stack, rows, cols, 3) in colour. Enabling it later through `call` does not resize the
+    shared states and fails.
+
+    The returned arrays are views onto the shared memory block and are overwritten by the next call to `step` or
+    `reset` - copy them if they need to be kept.
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        task: str,
+        act_freq: int,
+        num_envs: int,
+        emulation_speed: int = 0,
+        headless: bool = True,
+        dtype: np.dtype = np.float32,
+        start_method: str = "spawn",
+        backend: str = "pyboy",
+        reset_on_truncated: bool = True,
+        image_observation: dict = None,
+    ) -> None:
+        if num_envs < 1:
+            raise ValueError(f"num_envs must be at least 1: {num_envs}")
+
+        self.domain = domain
+        self.task = task
+        self.act_freq = act_freq
+        self.num_envs = num_envs
+        # Pixels are stored as they are observed
+        self.dtype = np.dtype(np.uint8 if image_observation is not None else dtype)
+        self.closed = False
+
+        context = mp.get_context(start_method)
+        pooled = start_method == "forkserver"
+
+        self.remotes = []
+        self.processes = []
+        launch_times = []
+        for index in range(num_envs):
+            remote, work_remote = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(
+                    index,
+                    work_remote,
+                    remote,
+                    domain,
+                    task,
+                    act_freq,
+                    emulation_speed,
+                    headless,
+                    backend,
+                    reset_on_truncated,
+                    pooled,
+                    image_observation,
+                ),
+                daemon=True,
+            )
+            launch_times.append(time.monotonic())
+            if pooled:
+                with zygote.preloading(context, [(domain, task, headless, backend)]):
+                    process.start()
+            else:
+                process.start()
+            work_remote.close()
+
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.shm = None
+        try:
+            specs = self._receive_all()
+            self.observation_space, self.action_num, _ = specs[0]
+
+            # Seconds from starting each worker process until its emulator was booted
+            self.worker_startup = [
+                {
+                    "pid": startup["pid"],
+                    "startup_time": startup["ready_time"] - launch_time,
+                    "preloaded": startup["preloaded"],
+                }
+                for (_, _, startup), launch_time in zip(specs, launch_times)
+            ]
+
+            size = _SharedBuffers.size(
+                num_envs, self.observation_space, self.action_num, self.dtype
+            )
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.buffers = _SharedBuffers(
+                self.shm, num_envs, self.observation_space, self.action_num, self.dtype
+            )
+
+            layout = (
+                self.shm.name,
+                num_envs,
+                self.observation_space,
+                self.action_num,
+                self.dtype,
+            )
+            for remote in self.remotes:
+                remote.send(("attach", layout))
+            self._receive_all()
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def final_states(self) -> np.ndarray:
+        return self.buffers.final_states
+
+    def reset(self) -> np.ndarray:
+        self._send_all("reset")
+        self._receive_all()
+        return self.buffers.states
+
+    def step(self, actions) -> tuple:
+        self.buffers.actions[:] = np.asarray(actions, dtype=np.float64).reshape(
+            self.num_envs, self.action_num
+        )
+
+        self._send_all("step")
+        self._receive_all()
+
+        return (
+            self.buffers.states,
+            self.buffers.rewards,
+            self.buffers.dones,
+            self.buffers.truncateds,
+        )
+
+    def set_seed(self, seed: int) -> None:
+        for index, remote in enumerate(self.remotes):
+            remote.send(("seed", seed + index))
+        self._receive_all()
+
+    def sample_action(self) -> np.ndarray:
+        return np.random.uniform(0, 1, size=(self.num_envs, self.action_num))
+
+    def call(self, name: str, *args, **kwargs) -> list:
+        # Calls a method (or reads an attribute) on every sub-environment, results are pickled back
+        self._send_all("call", (name, args, kwargs))
+        return self._receive_all()
+
+    def call_at(self, index: int, name: str, *args, **kwargs):
+        # Same as call, on a single sub-environment
+        remote = self.remotes[index]
+        remote.send(("call", (name, args, kwargs)))
+        status, data = remote.recv()
+        if status == "error":
+            logging.error(f"Worker {index}: {data}")
+            raise RuntimeError(f"Environment worker {index} failed")
+        return data
+
+    def worker_stats(self) -> list[dict]:
+        # Startup time plus the current unique/proportional memory of every worker
+        stats = []
+        for startup in self.worker_startup:
+            memory = zygote.unique_memory_mb(startup["pid"]) or {}
+            stats.append({**startup, **memory})
+        return stats
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        for remote in self.remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+        for remote in self.remotes:
+            remote.close()
+
+        if self.shm is not None:
+            self.buffers = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def _send_all(self, command: str, data=None) -> None:
+        for remote in self.remotes:
+            remote.send((command, data))
+
+    def _receive_all(self) -> list:
+        results = []
+        errors = []
+        for index, remote in enumerate(self.remotes):
+            try:
+                status, data = remote.recv()
+            except EOFError:
+                status, data = "error", "worker exited unexpectedly"
+
+            if status == "error":
+                errors.append(f"Worker {index}: {data}")
+            results.append(data)
+
+        if errors:
+            logging.error("\n".join(errors))
+            raise RuntimeError(f"{len(errors)} environment worker(s) failed")
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if not getattr(self, "closed", True):
+            self.close()
+
+    def __len__(self) -> int:
+        return self.num_envs
@@ -0,0 +1,95 @@
+"""
+Fork server ("zygote") preloading for VecPyboyEnvironment workers.
+
+With `start_method="forkserver"` the workers are forked from one server process instead of each starting a fresh
+interpreter. The server imports this module before it forks anything: it imports PyBoy, NumPy and the environment
+package, reads the task's init state into the init state cache and boots one emulator into the suite pool. Workers
+forked afterwards inherit all of it copy-on-write, `suite.make(..., pooled=True)` hands each one its inherited copy of
+the booted emulator, so a worker skips the imports, the ROM load and the init state read.
+
+The configurations to preload are passed through the PYBOY_ENV_PRELOAD environment variable, which the server
+inherits when it starts. The server is started once per parent process, so environments with a configuration that
+was not preloaded still work - their workers fall back to booting their own emulator.
+"""
+
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+PRELOAD_VARIABLE = "PYBOY_ENV_PRELOAD"
+
+
+def preload(configs: list) -> None:
+    # configs: list of (domain, task, headless, backend)
+    from pyboy_environment import suite
+
+    # The preloaded emulators are kept for as long as the server lives
+    suite.configure_pool(
+        max_size=max(suite.pool.max_size, len(configs)), idle_timeout=float("inf")
+    )
+
+    for domain, task, headless, backend in configs:
+        env = suite.make(
+            domain, task, 1, headless=headless, backend=backend, pooled=True
+        )
+        # Boots the emulator and loads the init state, which also fills the init state cache
+        env.pyboy
+        suite.release(env)
+
+
+@contextmanager
+def preloading(context, configs: list):
+    """
+    Makes the fork server of `context` preload `configs` if it is started inside the block - it starts with the first
+    process started through it.
+    """
+    context.set_forkserver_preload(["pyboy_environment.zygote"])
+
+    previous = os.environ.get(PRELOAD_VARIABLE)
+    os.environ[PRELOAD_VARIABLE] = json.dumps(configs)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[PRELOAD_VARIABLE]
+        else:
+            os.environ[PRELOAD_VARIABLE] = previous
+
+
+def unique_memory_mb(pid: int) -> dict | None:
+    """
+    Unique (USS) and proportional (PSS) set size of a process from /proc/<pid>/smaps_rollup, None where that is not
+    available. Pages shared copy-on-write with the fork server only count towards PSS.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+
+    # Values are reported in kB
+    fields = {}
+    for line in lines[1:]:
+        name, value = line.split(":", 1)
+        fields[name] = int(value.split()[0])
+
+    return {
+        "uss_mb": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+        "pss_mb": fields["Pss"] / 1024,
+        "rss_mb": fields["Rss"] / 1024,
+    }
+
+
+def _preload_from_environment() -> None:
+    configs = os.environ.get(PRELOAD_VARIABLE)
+    if not configs:
+        return
+    try:
+        preload(json.loads(configs))
+    except Exception:  # pylint: disable=broad-except
+        # A failed preload only costs the workers their head start
+        logging.exception("Fork server preload failed")
+
+
+_preload_from_environment()